@@ -0,0 +1,308 @@
+"""
+Benchmark every route registered on the Flask app through its WSGI interface.
+
+Seeds a database with a configurable catalog, then drives each route with a
+fixed number of concurrent clients and reports throughput, p50/p95/p99
+latency, SQL queries per request (counted per thread, so statements run
+while a streamed body is drained are included, and checked against each
+route's @query_budget) and peak RSS. Results are printed as a
+table and can be written as JSON to diff runs between commits:
+
+    python benchmarks/bench.py --planets 5000 --output before.json
+    python benchmarks/bench.py --database postgresql://localhost/bench --output pg.json
+
+The database is dropped and recreated, so never point --database at real data.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SKIPPED_PREFIXES = ("/admin", "/static")
+
+# The test client runs the view and drains the body on the calling thread
+thread_queries = threading.local()
+
+
+def install_query_counter():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        thread_queries.count = getattr(thread_queries, "count", 0) + 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", help="SQLAlchemy URL (default: a fresh SQLite file in a temp dir)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--planets", type=int, default=2000)
+    parser.add_argument("--characters", type=int, default=2000)
+    parser.add_argument("--starships", type=int, default=2000)
+    parser.add_argument("--favorites", type=int, default=20, help="favorites of each type per user")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="cost of the seeded password hashes")
+    parser.add_argument("--no-cache", action="store_true", help="disable the in-process read cache")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--routes", help="comma-separated endpoint names to run (default: all)")
+    parser.add_argument("--check-budgets", action="store_true",
+                        help="exit with status 1 if any request exceeds its route's @query_budget")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    # Must happen before the app is imported: it reads its config from the environment
+    database = args.database or "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = database
+    os.environ["BCRYPT_LOG_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ.setdefault("FLASK_APP_KEY", os.urandom(16).hex())  # tokens are refused without a real key
+    os.environ.setdefault("WORKER_THREADS", str(args.concurrency))
+    if args.no_cache:
+        os.environ["CACHE_TTL"] = "0"
+    sys.path.insert(0, os.path.join(ROOT, "src"))
+    return database
+
+
+def chunks(rows, size=1000):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def seed(args, rng):
+    """Create the schema and bulk-load the catalog. Returns the ids each route can use."""
+    from sqlalchemy import insert
+    from app import app
+    from models import db, User, Planet, Character, Starship, Favorite, FAVORITE_ITEM_TYPES
+    from passwords import password_hasher
+
+    extra = args.requests  # rows set aside for DELETE routes, never referenced by favorites
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = password_hasher.hash("benchmark")
+        tables = [
+            (User, args.users + extra, lambda i: {"username": f"user{i}", "email": f"user{i}@example.com",
+                                                  "password_hash": password_hash}),
+            (Planet, args.planets + extra, lambda i: {"name": f"Planet {i}", "mass": str(rng.randint(1, 10**6)),
+                                                      "description": f"Planet {i} in a desert system"}),
+            (Character, args.characters + extra, lambda i: {"name": f"Character {i}",
+                                                            "description": f"Character {i} from the outer rim"}),
+            (Starship, args.starships + extra, lambda i: {"name": f"Starship {i}", "speed": rng.randint(100, 5000),
+                                                          "faction": rng.choice(["Empire", "Rebel", "Neutral"]),
+                                                          "status": rng.choice(["active", "destroyed"])}),
+        ]
+        for model, count, make_row in tables:
+            for batch in chunks([make_row(i) for i in range(count)]):
+                db.session.execute(insert(model), batch)
+
+        db.session.execute(insert(Favorite), [{"user_id": user_id} for user_id in range(1, args.users + 1)])
+        favorite_pairs = []
+        sizes = {"planet": args.planets, "character": args.characters, "starship": args.starships}
+        for item_type, (model, column) in FAVORITE_ITEM_TYPES.items():
+            rows = []
+            for favorite_id in range(1, args.users + 1):
+                for item_id in rng.sample(range(1, sizes[item_type] + 1), min(args.favorites, sizes[item_type])):
+                    rows.append({"favorite_id": favorite_id, column.name: item_id})
+                    if item_type == "planet":
+                        favorite_pairs.append((favorite_id, item_id))
+            for batch in chunks(rows):
+                db.session.execute(insert(column.table), batch)
+        db.session.commit()
+
+    rng.shuffle(favorite_pairs)
+    return {
+        "users": args.users, "planets": args.planets, "characters": args.characters, "starships": args.starships,
+        "deletable": {name: iter(range(base + 1, base + extra + 1)) for name, base in
+                      (("user", args.users), ("planet", args.planets),
+                       ("character", args.characters), ("starship", args.starships))},
+        "favorite_pairs": iter(favorite_pairs),
+        "counter": itertools.count(),
+        "lock": threading.Lock(),
+    }
+
+
+def request_factory(rule, method, ids, rng):
+    """Return a function building (url, json_body, headers) for one request, or None if the route is not covered."""
+    from app import app
+    from auth import issue_tokens
+
+    endpoint = rule.endpoint
+    deleting = method == "DELETE"
+
+    def take(iterator):
+        with ids["lock"]:
+            return next(iterator, None)
+
+    def build():
+        with ids["lock"]:
+            n = next(ids["counter"])
+            values = {
+                "user_id": rng.randint(1, ids["users"]),
+                "planet_id": rng.randint(1, ids["planets"]),
+                "character_id": rng.randint(1, ids["characters"]),
+                "starship_id": rng.randint(1, ids["starships"]),
+                "item_type": "planet",
+                "item_id": rng.randint(1, ids["planets"]),
+                "source": "planets",
+            }
+        if deleting and endpoint == "delete_user_favorites":
+            pair = take(ids["favorite_pairs"])
+            if pair is None:
+                return None
+            values["user_id"], values["item_id"] = pair
+        elif deleting:
+            for arg in rule.arguments:
+                if arg.endswith("_id"):
+                    values[arg] = take(ids["deletable"][arg[:-3]])
+            if any(values[arg] is None for arg in rule.arguments):
+                return None
+
+        body = {
+            "crear_usuario": {"username": f"bench{n}", "email": f"bench{n}@example.com"},
+            "login": {"username": f"user{values['user_id'] - 1}", "password": "benchmark"},
+            "create_planet": {"name": f"New planet {n}", "mass": "1", "description": "benchmark"},
+            "create_starship": {"name": f"New starship {n}", "speed": 1000, "faction": "Rebel"},
+            "create_character": {"name": f"New character {n}", "description": "benchmark"},
+            "update_user_favorites": {"add": {"planet": [values["planet_id"]]},
+                                      "remove": {"character": [values["character_id"]]}},
+        }.get(endpoint)
+        with app.app_context():
+            tokens = issue_tokens(values["user_id"])
+        if endpoint == "refresh_token":
+            body = {"refresh_token": tokens["refresh_token"]}
+        url = rule.build(values, append_unknown=False)[1]
+        if endpoint == "search_catalog":
+            url += "?q=desert"
+        headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+        return url, body, headers
+
+    return build
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_route(build, method, args):
+    from app import app
+    local = threading.local()
+
+    def one_request(_):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        spec = build()
+        if spec is None:
+            return None
+        url, body, headers = spec
+        thread_queries.count = 0
+        start = time.perf_counter()
+        response = local.client.open(url, method=method, json=body, headers=headers)
+        response.get_data()  # drain streamed bodies inside the timing
+        elapsed = time.perf_counter() - start
+        return elapsed, response.status_code, thread_queries.count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        samples = [s for s in pool.map(one_request, range(args.requests)) if s is not None]
+    wall = time.perf_counter() - start
+
+    latencies = sorted(s[0] * 1000 for s in samples)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / wall, 1) if wall else None,
+        "p50_ms": round(percentile(latencies, 0.50), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "queries_per_request": round(sum(s[2] for s in samples) / len(samples), 2) if samples else None,
+        "max_queries": max((s[2] for s in samples), default=None),
+        "statuses": statuses,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    database = configure_environment(args)
+    ids = seed(args, rng)
+    install_query_counter()
+
+    from app import app
+    wanted = set(args.routes.split(",")) if args.routes else None
+    # Reads first, then writes, then deletes, so earlier routes see the seeded data unchanged
+    order = {"GET": 0, "POST": 1, "PATCH": 1, "PUT": 1, "DELETE": 2}
+    routes = sorted(
+        ((rule, method) for rule in app.url_map.iter_rules()
+         if not rule.rule.startswith(SKIPPED_PREFIXES)
+         for method in rule.methods - {"HEAD", "OPTIONS"}),
+        key=lambda item: (order.get(item[1], 1), item[0].rule))
+
+    results = []
+    for rule, method in routes:
+        if wanted and rule.endpoint not in wanted:
+            continue
+        stats = run_route(request_factory(rule, method, ids, rng), method, args)
+        stats.update({"endpoint": rule.endpoint, "method": method, "rule": rule.rule,
+                      "query_budget": getattr(app.view_functions[rule.endpoint], "query_budget", None)})
+        results.append(stats)
+        print(f"{method:6} {rule.rule:58} {stats['throughput_rps'] or 0:>9.1f} rps  "
+              f"p50 {stats['p50_ms'] or 0:>8.2f}  p95 {stats['p95_ms'] or 0:>8.2f}  "
+              f"p99 {stats['p99_ms'] or 0:>8.2f} ms  {stats['queries_per_request'] or 0:>6.2f} q/req  "
+              f"{stats['statuses']}")
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "database": database.split("://")[0],
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "database")},
+        "peak_rss_mb": peak_rss_mb(),
+        "routes": results,
+    }
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"wrote {args.output}")
+
+    over_budget = [r for r in results if r["query_budget"] is not None
+                   and r["max_queries"] is not None and r["max_queries"] > r["query_budget"]]
+    for r in over_budget:
+        print(f"OVER BUDGET: {r['method']} {r['rule']} issued {r['max_queries']} queries, budget is {r['query_budget']}")
+    if args.check_budgets and over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
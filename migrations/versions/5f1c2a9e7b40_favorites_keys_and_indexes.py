@@ -0,0 +1,67 @@
+"""favorites keys and indexes
+
+Revision ID: 5f1c2a9e7b40
+Revises: 934813a1f6e4
+Create Date: 2026-10-18 10:40:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f1c2a9e7b40'
+down_revision = '934813a1f6e4'
+branch_labels = None
+depends_on = None
+
+ASSOCIATION_TABLES = [
+    ('favorites_planets', 'planets_id'),
+    ('favorites_characters', 'characters_id'),
+    ('favorites_starships', 'starship_id'),
+]
+
+
+def upgrade():
+    # Fold duplicate favorites rows into the oldest one per user before adding the unique index
+    for table, _ in ASSOCIATION_TABLES:
+        op.execute(
+            f"UPDATE {table} SET favorite_id = ("
+            f"SELECT MIN(f2.id) FROM favorites f1 JOIN favorites f2 ON f2.user_id = f1.user_id "
+            f"WHERE f1.id = {table}.favorite_id)"
+        )
+    op.execute("DELETE FROM favorites WHERE id NOT IN (SELECT MIN(id) FROM favorites GROUP BY user_id)")
+
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_favorites_user_id'), ['user_id'], unique=True)
+
+    for table, item_column in ASSOCIATION_TABLES:
+        # Drop NULL and duplicate pairs so the composite primary key can be created
+        op.execute(
+            f"CREATE TABLE {table}_dedup AS SELECT DISTINCT favorite_id, {item_column} FROM {table} "
+            f"WHERE favorite_id IS NOT NULL AND {item_column} IS NOT NULL"
+        )
+        op.execute(f"DELETE FROM {table}")
+        op.execute(
+            f"INSERT INTO {table} (favorite_id, {item_column}) "
+            f"SELECT favorite_id, {item_column} FROM {table}_dedup"
+        )
+        op.execute(f"DROP TABLE {table}_dedup")
+
+        with op.batch_alter_table(table, schema=None, recreate='always') as batch_op:
+            batch_op.alter_column('favorite_id', existing_type=sa.Integer(), nullable=False)
+            batch_op.alter_column(item_column, existing_type=sa.Integer(), nullable=False)
+            batch_op.create_primary_key(f'{table}_pkey', ['favorite_id', item_column])
+            batch_op.create_index(batch_op.f(f'ix_{table}_{item_column}'), [item_column], unique=False)
+
+
+def downgrade():
+    for table, item_column in ASSOCIATION_TABLES:
+        with op.batch_alter_table(table, schema=None, recreate='always') as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_{item_column}'))
+            batch_op.drop_constraint(f'{table}_pkey', type_='primary')
+            batch_op.alter_column(item_column, existing_type=sa.Integer(), nullable=True)
+            batch_op.alter_column('favorite_id', existing_type=sa.Integer(), nullable=True)
+
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_favorites_user_id'))
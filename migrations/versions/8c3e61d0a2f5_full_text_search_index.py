@@ -0,0 +1,61 @@
+"""full text search index
+
+Revision ID: 8c3e61d0a2f5
+Revises: 5f1c2a9e7b40
+Create Date: 2026-10-18 11:52:40.907113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3e61d0a2f5'
+down_revision = '5f1c2a9e7b40'
+branch_labels = None
+depends_on = None
+
+SEARCHABLE = {
+    'planets': ['name', 'description'],
+    'characters': ['name', 'description'],
+    'starships': ['name', 'faction', 'status'],
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table, columns in SEARCHABLE.items():
+        cols = ", ".join(columns)
+        new = ", ".join(f"new.{c}" for c in columns)
+        old = ", ".join(f"old.{c}" for c in columns)
+        if dialect == 'sqlite':
+            op.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5({cols}, content='{table}', content_rowid='id')")
+            op.execute(
+                f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {table}_fts(rowid, {cols}) VALUES (new.id, {new}); END")
+            op.execute(
+                f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {table}_fts({table}_fts, rowid, {cols}) VALUES ('delete', old.id, {old}); END")
+            op.execute(
+                f"CREATE TRIGGER {table}_fts_update AFTER UPDATE ON {table} BEGIN "
+                f"INSERT INTO {table}_fts({table}_fts, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+                f"INSERT INTO {table}_fts(rowid, {cols}) VALUES (new.id, {new}); END")
+            op.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+        elif dialect == 'postgresql':
+            document = " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+            op.execute(
+                f"ALTER TABLE {table} ADD COLUMN search_vector tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('english', {document})) STORED")
+            op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], postgresql_using='gin')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table in SEARCHABLE:
+        if dialect == 'sqlite':
+            for suffix in ('insert', 'delete', 'update'):
+                op.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+            op.execute(f"DROP TABLE IF EXISTS {table}_fts")
+        elif dialect == 'postgresql':
+            op.drop_index(f'ix_{table}_search_vector', table_name=table)
+            op.drop_column(table, 'search_vector')
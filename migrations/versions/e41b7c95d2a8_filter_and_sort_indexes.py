@@ -0,0 +1,37 @@
+"""filter and sort indexes
+
+Revision ID: e41b7c95d2a8
+Revises: 8c3e61d0a2f5
+Create Date: 2026-10-18 11:02:37.540118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b7c95d2a8'
+down_revision = '8c3e61d0a2f5'
+branch_labels = None
+depends_on = None
+
+# table -> indexed columns: sortable columns are indexed together with id so that a keyset
+# page on (column, id) is a single index range scan, filter-only columns on their own
+INDEXES = [
+    ('planets', [['name', 'id']]),
+    ('characters', [['name', 'id']]),
+    ('starships', [['name', 'id'], ['speed', 'id'], ['faction'], ['status']]),
+]
+
+
+def upgrade():
+    for table, indexes in INDEXES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for columns in indexes:
+                batch_op.create_index(batch_op.f(f"ix_{table}_{'_'.join(columns)}"), columns, unique=False)
+
+
+def downgrade():
+    for table, indexes in INDEXES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for columns in indexes:
+                batch_op.drop_index(batch_op.f(f"ix_{table}_{'_'.join(columns)}"))
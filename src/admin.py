@@ -1,7 +1,16 @@
 import os
-from flask_admin import Admin
+from flask_admin import Admin, BaseView, expose
 from models import db, User, Favorite, Planet, Character, Starship
 from flask_admin.contrib.sqla import ModelView
+from slow_queries import slow_query_log
+
+class SlowQueryView(BaseView):
+    @expose('/')
+    def index(self):
+        threshold = slow_query_log.threshold
+        return self.render('admin/slow_queries.html',
+                           entries=slow_query_log.recent(),
+                           threshold_ms=threshold * 1000 if threshold is not None else None)
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
@@ -15,6 +24,7 @@ def setup_admin(app):
     admin.add_view(ModelView(Planet, db.session))
     admin.add_view(ModelView(Character, db.session))
     admin.add_view(ModelView(Starship, db.session))
+    admin.add_view(SlowQueryView(name='Slow queries', endpoint='slow_queries'))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
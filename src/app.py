@@ -2,17 +2,35 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from sqlalchemy import select
-from flask import Flask, request, jsonify, url_for
+import sys
+import time
+import click
+from sqlalchemy import select, delete
+from flask import Flask, request, jsonify, url_for, Response, stream_with_context
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from utils import (APIException, generate_sitemap, get_page_args, get_ids_arg, get_includes, get_list_args,
+                   unindexed_filters, metadata_indexes, database_indexes, batch_get, collection_page,
+                   get_stream_format, stream_collection, setup_query_counter,
+                   collection_etag, is_fresh, with_validators, not_modified_response,
+                   bulk_insert, insert_ignoring_conflicts, get_fields, FastJSONProvider, query_budget)
 from admin import setup_admin
-from models import db, User, Planet, Character, Starship, Favorite
+from cache import read_cache, cached_entity, setup_cache
+from auth import issue_tokens, decode_token, token_required, authenticate, signing_key_configured
+from passwords import password_hasher
+from search import search, include_object
+from pool import engine_options, pool_stats
+from replicas import replica_binds, read_replica, copy_sqlite_primary, REPLICA_PREFIX
+from metrics import setup_metrics, metrics_response
+from slow_queries import setup_slow_query_log
+from catalog_io import CATALOGS, read_records, import_catalog, EXPORT_SOURCES, export_stream
+from models import (db, User, Planet, Character, Starship, Favorite, favorites_for_user,
+                    FAVORITE_ITEM_TYPES, FAVORITE_COLLECTIONS, favorite_collections)
 # from models import Person
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.url_map.strict_slashes = False
 
 db_url = os.getenv("DATABASE_URL")
@@ -22,11 +40,42 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_BINDS'] = replica_binds(os.getenv("DATABASE_REPLICA_URLS", ""))
+app.config['REPLICA_MAX_LAG'] = float(os.getenv("REPLICA_MAX_LAG", 5))
+app.config['DEFAULT_PAGE_SIZE'] = int(os.getenv("DEFAULT_PAGE_SIZE", 50))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv("MAX_PAGE_SIZE", 200))
+app.config['STREAM_CHUNK_SIZE'] = int(os.getenv("STREAM_CHUNK_SIZE", 500))
+app.config['CACHE_MAX_ENTRIES'] = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+app.config['CACHE_TTL'] = int(os.getenv("CACHE_TTL", 60))
+app.config['MAX_BULK_ITEMS'] = int(os.getenv("MAX_BULK_ITEMS", 1000))
+app.config['MAX_BATCH_IDS'] = int(os.getenv("MAX_BATCH_IDS", 100))
+app.config['ACCESS_TOKEN_TTL'] = int(os.getenv("ACCESS_TOKEN_TTL", 15 * 60))
+app.config['REFRESH_TOKEN_TTL'] = int(os.getenv("REFRESH_TOKEN_TTL", 14 * 24 * 3600))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.getenv("PASSWORD_HASH_QUEUE", 8))
+app.config['SLOW_QUERY_MS'] = float(os.environ["SLOW_QUERY_MS"]) if os.getenv("SLOW_QUERY_MS") else None
+app.config['SLOW_QUERY_BUFFER'] = int(os.getenv("SLOW_QUERY_BUFFER", 100))
+
+# Collections with ?field= filters and ?sort=; every one of them must be backed by an index
+LISTABLE_MODELS = (User, Planet, Character, Starship)
+for listable in LISTABLE_MODELS:
+    unindexed = unindexed_filters(listable, metadata_indexes(listable.__table__))
+    if unindexed:
+        raise RuntimeError(f"{listable.__name__} filters/sorts without an index: {', '.join(unindexed)}")
+
+MIGRATE = Migrate(app, db, include_object=include_object)
 db.init_app(app)
+password_hasher.init_app(app)
 CORS(app)
 setup_admin(app)
+if not signing_key_configured(app):
+    app.logger.error("FLASK_APP_KEY is missing or a placeholder: login and token routes will fail until it is set")
+setup_query_counter(app)
+setup_cache(app)
+setup_metrics(app)
+setup_slow_query_log(app)
 
 # Handle/serialize errors like a JSON object
 
@@ -34,37 +83,67 @@ setup_admin(app)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+# Shared body of the collection GET endpoints: batch lookup by ?ids=, filters and sort,
+# conditional GET, streaming and cached keyset pages
+
+def list_collection(model):
+    ids = get_ids_arg()
+    if ids is not None:
+        return jsonify(batch_get(db.session, model, ids, get_fields(model))), 200
+    filters, sort = get_list_args(model)
+    limit, after = get_page_args(sort)
+    stream_format = get_stream_format()
+    etag = collection_etag(db.session, model, stream_format)
+    fields = get_fields(model)
+    if is_fresh(etag):
+        response = not_modified_response(etag)
+    elif stream_format:
+        response = with_validators(stream_collection(db.session, model, stream_format, after, fields, filters, sort),
+                                   etag)
+    else:
+        # The ETag is part of the key: a write from another worker or the CLI changes it, so a
+        # page cached before that write is never served under the new validators
+        response = with_validators(jsonify(read_cache.get_or_load(
+            (model.__name__, "collection", etag, limit, after, fields, filters, sort),
+            lambda: collection_page(db.session, model, limit, after, fields, filters, sort))), etag)
+    # the stream format can be negotiated from Accept, and it is part of the ETag
+    response.vary.add("Accept")
+    return response
+
 # generate sitemap with all your endpoints
 
 @app.route('/')
+@query_budget(0)
 def sitemap():
     return generate_sitemap(app)
 
 # User endpoints
 
 @app.route('/users', methods=["POST"])
+@query_budget(2)
 def crear_usuario():
     data = request.get_json()
     user = User(
         email = data.get('email'),
         username = data.get('username')
     )
+    if data.get('password'):
+        user.set_password(data.get('password'))
     db.session.add(user)
     db.session.commit()
     
-    user.set_password()
-    
     return user.serialize(), 200
 
-#ABK
-
-@app.route('/users', methods=['POST'])
-def get_all_users():
+@app.route('/login', methods=['POST'])
+@query_budget(2)
+def login():
     body = request.get_json()#se manda un body con username y password del front
+    if not isinstance(body, dict):
+        return jsonify({"message": "Expected a JSON object with username and password"}), 400
     username = body.get("username", None)
     password = body.get("password")
-    if not username:
-        return jsonify({"message": "username is a required field"}),400
+    if not isinstance(username, str) or not isinstance(password, str) or not username or not password:
+        return jsonify({"message": "username and password are required fields"}),400
     
     user = db.session.execute(select(User).where(User.username==username)).scalars().first()
 
@@ -74,32 +153,52 @@ def get_all_users():
     if not user.check_password(password):
         return jsonify({"message":"Bad credentials"}),400
     
-#ABK
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    result = list(map(lambda item: item.serialize(), data))
-    print(result[0])
+    # BCRYPT_LOG_ROUNDS changed since this hash was made: upgrade it while we have the password
+    if user.password_needs_rehash():
+        user.set_password(password)
+        db.session.commit()
     
-    response_body = {"results": result}
-    return jsonify(response_body), 200
+    return jsonify(issue_tokens(user.id)), 200
+
+@app.route('/token/refresh', methods=['POST'])
+@query_budget(0)
+def refresh_token():
+    body = request.get_json()
+    if not isinstance(body, dict):
+        return jsonify({"message": "Expected a JSON object with a refresh_token"}), 400
+    user_id = decode_token(body.get("refresh_token", ""), "refresh")
+    return jsonify(issue_tokens(user_id)), 200
+
+@app.route('/users', methods=['GET'])
+@query_budget(2)
+@read_replica
+def list_all_users():
+    return list_collection(User)
+
+USER_INCLUDES = ("favorites",) + tuple(f"favorites.{name}" for name in FAVORITE_COLLECTIONS)
 
 @app.route('/users/<int:user_id>', methods=['GET'])  
+@query_budget(1 + len(FAVORITE_COLLECTIONS))
+@read_replica
 def get_single_user(user_id):
-    user = db.session.get(User, user_id)
+    includes = get_includes(USER_INCLUDES)
+    if includes:
+        authenticate(user_id)  # favorites are private, as on /users/favorites/<user_id>
+    user = cached_entity(db.session, User, user_id, get_fields(User))
     if not user:
-        return jsonify({"Message":"User_id not found in database"})
-    return jsonify(user.serialize()), 200
+        return jsonify({"Message":"User_id not found in database"}), 404
+    if includes:
+        # Compound document: the user's validators don't cover the favorites, so none are sent
+        collections = list(FAVORITE_COLLECTIONS) if "favorites" in includes else \
+            [path.split(".", 1)[1] for path in USER_INCLUDES if path in includes and "." in path]
+        data = dict(user["data"], favorites=favorite_collections(db.session, user_id, collections))
+        return jsonify(data), 200
+    if is_fresh(user["etag"], user["last_modified"]):
+        return not_modified_response(user["etag"], user["last_modified"])
+    return with_validators(jsonify(user["data"]), user["etag"], user["last_modified"]), 200
 
 @app.route('/users/<int:user_id>', methods=['DELETE'])  
+@query_budget(3)
 def delete_single_user(user_id):
     user = db.session.get(User, user_id)
     
@@ -110,11 +209,30 @@ def delete_single_user(user_id):
     db.session.commit()
     return jsonify("deleted user", user_id)
 
+@app.route('/metrics', methods=['GET'])
+@query_budget(0)
+def get_metrics():
+    return metrics_response()
+
+@app.route('/cache/stats', methods=['GET'])
+@query_budget(0)
+def get_cache_stats():
+    return jsonify(read_cache.stats()), 200
+
+@app.route('/pool/stats', methods=['GET'])
+@query_budget(0)
+def get_pool_stats():
+    return jsonify(pool_stats(db.engines)), 200
+
 # Planet endpoints
 
 @app.route('/planets', methods=["POST"])
+@query_budget(2)
 def create_planet():
     data = request.get_json()
+    if isinstance(data, list):
+        ids = bulk_insert(db.session, Planet, data, ["name", "mass", "description"])
+        return jsonify({"ids": ids}), 200
     planet = Planet(
         name = data.get('name'),
         mass = data.get('mass'),
@@ -125,19 +243,26 @@ def create_planet():
     return planet.serialize(), 200
 
 @app.route('/planets', methods=['GET'])
+@query_budget(2)
+@read_replica
 def get_all_planets():
-    data = db.session.execute(select(Planet)).scalars()
-    result = list(map(lambda item: item.serialize(), data))
-    response_body = {"results": result}
-    print("hello")
-    return jsonify(response_body), 200
+    return list_collection(Planet)
 
 @app.route('/planets/<int:planet_id>', methods=['GET'])  
+@query_budget(1)
+@read_replica
 def get_single_planet(planet_id):
-    planet = db.session.get(Planet, planet_id)
-    return jsonify(planet.serialize()), 200
+    planet = cached_entity(db.session, Planet, planet_id, get_fields(Planet))
+    
+    if not planet:
+        return jsonify({"message":"No planet found with specified ID"}), 404
+    
+    if is_fresh(planet["etag"], planet["last_modified"]):
+        return not_modified_response(planet["etag"], planet["last_modified"])
+    return with_validators(jsonify(planet["data"]), planet["etag"], planet["last_modified"]), 200
 
 @app.route('/planets/<int:planet_id>', methods=['DELETE'])  
+@query_budget(2)
 def delete_single_planet(planet_id):
     planet = db.session.get(Planet, planet_id)
         
@@ -151,8 +276,12 @@ def delete_single_planet(planet_id):
 # Starship endpoints
 
 @app.route('/starships', methods=["POST"])
+@query_budget(2)
 def create_starship():
     data = request.get_json()
+    if isinstance(data, list):
+        ids = bulk_insert(db.session, Starship, data, ["name", "speed", "faction"])
+        return jsonify({"ids": ids}), 200
     starship = Starship(
         name = data.get('name'),
         speed = data.get('speed'),
@@ -163,19 +292,26 @@ def create_starship():
     return starship.serialize(), 200
 
 @app.route('/starships', methods=['GET'])
+@query_budget(3)  # a page sorted on speed may also read the NULL speeds
+@read_replica
 def get_all_starships():
-    data = db.session.execute(select(Starship)).scalars()
-    result = list(map(lambda item: item.serialize(), data))
-    response_body = {"results": result}
-    print("hello")
-    return jsonify(response_body), 200
+    return list_collection(Starship)
     
 @app.route('/starships/<int:starship_id>', methods=['GET'])  
+@query_budget(1)
+@read_replica
 def get_single_starship(starship_id):
-    single_starship = db.session.get(Starship, starship_id)
-    return jsonify(single_starship.serialize()), 200
+    single_starship = cached_entity(db.session, Starship, starship_id, get_fields(Starship))
+    
+    if not single_starship:
+        return jsonify({"message":"No starship found with specified ID"}), 404
+    
+    if is_fresh(single_starship["etag"], single_starship["last_modified"]):
+        return not_modified_response(single_starship["etag"], single_starship["last_modified"])
+    return with_validators(jsonify(single_starship["data"]), single_starship["etag"], single_starship["last_modified"]), 200
 
 @app.route('/starships/<int:starship_id>', methods=['DELETE'])  
+@query_budget(2)
 def delete_single_starship(starship_id):
     starship = db.session.get(Starship, starship_id)
         
@@ -189,8 +325,12 @@ def delete_single_starship(starship_id):
 # Character endpoints
 
 @app.route('/characters', methods=["POST"])
+@query_budget(2)
 def create_character():
     data = request.get_json()
+    if isinstance(data, list):
+        ids = bulk_insert(db.session, Character, data, ["name", "description"])
+        return jsonify({"ids": ids}), 200
     character = Character(
         name = data.get('name'),
         description = data.get('description')  
@@ -199,29 +339,27 @@ def create_character():
     db.session.commit()
     return character.serialize(), 200
 
-@app.route('/users/favorites/<int:user_id>', methods=['GET'])
-def get_user_favorites(user_id):
-    print(user_id)
-    favorite = db.session.execute(
-        select(Favorite).where(Favorite.user_id == user_id)
-    ).scalars().one_or_none()
-    
-    if not favorite:
-        return jsonify({"message": "No favorites found for this user"}), 404
-    
-    print(favorite.serialize())
-    return jsonify(favorite.serialize()), 200
-    
+@app.route('/characters', methods=['GET'])
+@query_budget(2)
+@read_replica
+def get_all_characters():
+    return list_collection(Character)
+
 @app.route('/characters/<int:character_id>', methods=['GET'])  
+@query_budget(1)
+@read_replica
 def get_single_character(character_id):
-    single_character = db.session.get(Character, character_id)
+    single_character = cached_entity(db.session, Character, character_id, get_fields(Character))
     
     if not single_character:
-        return jsonify({"message":"No character found with specified ID"})
+        return jsonify({"message":"No character found with specified ID"}), 404
     
-    return jsonify(single_character.serialize()), 200
+    if is_fresh(single_character["etag"], single_character["last_modified"]):
+        return not_modified_response(single_character["etag"], single_character["last_modified"])
+    return with_validators(jsonify(single_character["data"]), single_character["etag"], single_character["last_modified"]), 200
 
 @app.route('/characters/<int:character_id>', methods=['DELETE'])
+@query_budget(2)
 def del_single_character(character_id):
     single_character = db.session.get(Character, character_id)
     
@@ -237,93 +375,298 @@ def del_single_character(character_id):
 # Favorites table and endpoints
 
 @app.route('/users/favorites/<int:user_id>', methods=['GET'])
+@query_budget(4)
+@read_replica
+@token_required
 def get_user_favorites(user_id):
-    print(user_id)
-    favorites_table= db.session.get(Favorite, user_id)
-    print(favorites_table.serialize())
-    return jsonify(favorites_table.serialize()), 200
+    favorite = db.session.execute(favorites_for_user(user_id)).scalars().one_or_none()
+    
+    if not favorite:
+        return jsonify({"message": "No favorites found for this user"}), 404
+    
+    return jsonify(favorite.serialize()), 200
+
+
+def favorite_for_update(user_id):
+    """The user's Favorite row with its collections, created if missing. ON CONFLICT DO NOTHING and a
+    re-select instead of check-then-insert: concurrent first writes for the same user must not race
+    into an IntegrityError on the unique favorites.user_id."""
+    favorite = db.session.execute(favorites_for_user(user_id)).scalars().one_or_none()
+    if favorite is None:
+        db.session.execute(insert_ignoring_conflicts(db.session, Favorite.__table__, ["user_id"]),
+                           {"user_id": user_id})
+        favorite = db.session.execute(favorites_for_user(user_id)).scalars().one()
+    return favorite
 
 
 @app.route('/users/favorites/<int:user_id>/<string:item_type>/<int:item_id>', methods=['POST'])
+@query_budget(13)  # a user's first favorite also inserts and re-selects the Favorite row
+@token_required
 def add_user_favorites(user_id,item_type,item_id):
     user=db.session.get(User, user_id)
     
     if not user:
         return ({"Message":"No user found with specified ID"}), 400
     
-    favorite = db.session.execute(select(Favorite).where(Favorite.user_id == user_id)).scalars().one_or_none()
-    print(favorite)
-    if not favorite:
-        favorite = Favorite(user_id=user_id)
-        db.session.add(favorite)
-        db.session.commit()
+    favorite = favorite_for_update(user_id)
         
     if item_type == "planet":
         planet = db.session.get(Planet, item_id)
         
         if not planet:
             return jsonify({"message":"No planet found with item_id"})
-        favorite.planets.append(planet)
+        if planet not in favorite.planets:
+            favorite.planets.append(planet)
         
     if item_type == "character":
         character = db.session.get(Character, item_id)
         
         if not character:
             return jsonify({"message":"No character found with item_id"})
-        favorite.characters.append(character)
+        if character not in favorite.characters:
+            favorite.characters.append(character)
 
     if item_type == "starship":
         starship = db.session.get(Starship, item_id)
         
         if not starship:
             return jsonify({"message":"No starship found with item_id"})
-        favorite.starships.append(starship)
+        if starship not in favorite.starships:
+            favorite.starships.append(starship)
     
     db.session.commit()
     
+    # commit() expires the instance; reload it in one round of batched queries
+    favorite = db.session.execute(favorites_for_user(user_id)).scalars().one()
     return favorite.serialize()
 
 
 @app.route('/users/favorites/<int:user_id>/<string:item_type>/<int:item_id>', methods=['DELETE'])
+@query_budget(12)
+@token_required
 def delete_user_favorites(user_id,item_type,item_id):
     user=db.session.get(User, user_id)
     
     if not user:
         return ({"Message":"No user found with specified ID"}), 400
     
-    favorite = db.session.execute(select(Favorite).where(Favorite.user_id == user_id)).scalars().one_or_none()
-    print(favorite)
-    if not favorite:
-        favorite = Favorite(user_id=user_id)
-        db.session.add(favorite)
-        db.session.commit()
+    favorite = favorite_for_update(user_id)
         
     if item_type == "planet":
         planet = db.session.get(Planet, item_id)
         
         if not planet:
             return jsonify({"message":"No planet found with item_id"})
-        favorite.planets.remove(planet)
+        if planet in favorite.planets:
+            favorite.planets.remove(planet)
         
     if item_type == "character":
         character = db.session.get(Character, item_id)
         
         if not character:
             return jsonify({"message":"No character found with item_id"})
-        favorite.characters.remove(character)
+        if character in favorite.characters:
+            favorite.characters.remove(character)
 
     if item_type == "starship":
         starship = db.session.get(Starship, item_id)
         
         if not starship:
             return jsonify({"message":"No starship found with item_id"})
-        favorite.starships.remove(starship)
+        if starship in favorite.starships:
+            favorite.starships.remove(starship)
+    
+    db.session.commit()
+    
+    # commit() expires the instance; reload it in one round of batched queries
+    favorite = db.session.execute(favorites_for_user(user_id)).scalars().one()
+    return favorite.serialize()
+
+
+@app.route('/users/favorites/<int:user_id>', methods=['PATCH'])
+@query_budget(20)
+@token_required
+def update_user_favorites(user_id):
+    body = request.get_json() or {}
+    changes = {"add": body.get("add") or {}, "remove": body.get("remove") or {}}
+    
+    for action, items in changes.items():
+        if not isinstance(items, dict):
+            raise APIException(f"'{action}' must map item types to lists of ids")
+        for item_type, ids in items.items():
+            if item_type not in FAVORITE_ITEM_TYPES:
+                raise APIException(f"Unknown item type '{item_type}'")
+            # bool is an int subclass; JSON true/false are not ids
+            if not isinstance(ids, list) or not all(
+                    isinstance(item_id, int) and not isinstance(item_id, bool) for item_id in ids):
+                raise APIException(f"'{action}.{item_type}' must be a list of integer ids")
+    
+    user = db.session.get(User, user_id)
+    if not user:
+        return ({"Message":"No user found with specified ID"}), 400
+    
+    # Validate every referenced id with one IN query per item type before writing anything
+    missing = {}
+    for item_type in set(changes["add"]) | set(changes["remove"]):
+        model, _ = FAVORITE_ITEM_TYPES[item_type]
+        requested = set(changes["add"].get(item_type, [])) | set(changes["remove"].get(item_type, []))
+        found = set(db.session.scalars(select(model.id).where(model.id.in_(requested))))
+        if requested - found:
+            missing[item_type] = sorted(requested - found)
+    if missing:
+        raise APIException("Some items do not exist", status_code=404, payload={"missing": missing})
+    
+    # ON CONFLICT DO NOTHING instead of check-then-insert: concurrent PATCHes of the
+    # same user or the same item must not race into an IntegrityError
+    favorite_id = db.session.scalars(select(Favorite.id).where(Favorite.user_id == user_id)).one_or_none()
+    if favorite_id is None:
+        db.session.execute(insert_ignoring_conflicts(db.session, Favorite.__table__, ["user_id"]),
+                           {"user_id": user_id})
+        favorite_id = db.session.scalars(select(Favorite.id).where(Favorite.user_id == user_id)).one()
+    
+    for item_type, ids in changes["add"].items():
+        _, column = FAVORITE_ITEM_TYPES[item_type]
+        if ids:
+            db.session.execute(
+                insert_ignoring_conflicts(db.session, column.table, ["favorite_id", column.name]),
+                [{"favorite_id": favorite_id, column.name: item_id} for item_id in sorted(set(ids))])
+    
+    for item_type, ids in changes["remove"].items():
+        _, column = FAVORITE_ITEM_TYPES[item_type]
+        if ids:
+            db.session.execute(
+                delete(column.table).where(column.table.c.favorite_id == favorite_id, column.in_(ids)))
     
     db.session.commit()
     
+    favorite = db.session.execute(favorites_for_user(user_id)).scalars().one()
     return favorite.serialize()
 
 
+# Export endpoints
+
+@app.route('/export/<string:source>', methods=['GET'])
+@query_budget(1)
+def export_table(source):
+    # Catalogs only: the favorites export lists every user's favorites, so it is CLI-only
+    # (flask export-catalog favorites), like the per-user data behind token_required
+    if source not in CATALOGS:
+        return jsonify({"message": f"Unknown export, expected one of {', '.join(sorted(CATALOGS))}"}), 404
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        raise APIException("format must be ndjson or csv")
+    compress = request.accept_encodings["gzip"] > 0
+    body = export_stream(db.session, source, fmt, app.json.dumps, compress=compress,
+                         chunk_rows=app.config["STREAM_CHUNK_SIZE"])
+    # No Content-Length: the WSGI server sends the body with chunked transfer encoding
+    response = Response(stream_with_context(body),
+                        mimetype="text/csv" if fmt == "csv" else "application/x-ndjson")
+    # gzip is a content encoding the client undoes, so the saved file keeps its plain name
+    response.headers["Content-Disposition"] = f"attachment; filename={source}.{fmt}"
+    response.headers["Vary"] = "Accept-Encoding"
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+# Search endpoint
+
+@app.route('/search', methods=['GET'])
+@query_budget(4)
+def search_catalog():
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"message": "q is a required query parameter"}), 400
+    limit, _ = get_page_args()
+    offset = request.args.get("offset", 0, type=int)
+    if offset < 0:
+        raise APIException("offset must be 0 or greater")
+    hits, next_offset = search(db.session, q, limit, offset)
+    return jsonify({"results": hits, "next": next_offset}), 200
+
+
+# CLI commands
+
+@app.cli.command("import-catalog")
+@click.argument("catalog", type=click.Choice(sorted(CATALOGS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option("--format", "fmt", type=click.Choice(["json", "ndjson", "csv"]),
+              help="Input format; guessed from the file extension when omitted.")
+@click.option("--chunk-size", default=1000, show_default=True, help="Rows per upsert and commit.")
+@click.option("--no-copy", is_flag=True, help="On Postgres, use INSERT ... ON CONFLICT instead of COPY.")
+def import_catalog_command(catalog, path, fmt, chunk_size, no_copy):
+    """Stream a JSON/NDJSON/CSV dump into planets, characters or starships, upserting on id."""
+    if fmt is None:
+        extension = os.path.splitext(path)[1].lower().lstrip(".")
+        fmt = {"jsonl": "ndjson", "ndjson": "ndjson", "csv": "csv"}.get(extension, "json")
+    started = time.perf_counter()
+
+    def progress(total):
+        elapsed = time.perf_counter() - started
+        click.echo(f"{total} rows, {total / elapsed:.0f} rows/s", err=True)
+
+    handle = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+    try:
+        total = import_catalog(db.session, catalog, read_records(handle, fmt),
+                               chunk_size=chunk_size, use_copy=not no_copy, progress=progress)
+    except ValueError as error:
+        db.session.rollback()
+        raise click.ClickException(str(error))
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+    elapsed = time.perf_counter() - started
+    click.echo(f"Imported {total} {catalog} in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/s)")
+
+
+@app.cli.command("export-catalog")
+@click.argument("source", type=click.Choice(EXPORT_SOURCES))
+@click.option("--format", "fmt", type=click.Choice(["ndjson", "csv"]), default="ndjson", show_default=True)
+@click.option("--output", "-o", default="-", help="File to write; stdout by default.")
+@click.option("--gzip", "compress", is_flag=True, help="gzip-compress the output.")
+def export_catalog_command(source, fmt, output, compress):
+    """Stream a catalog table, or the flattened user favorites, as NDJSON or CSV."""
+    started = time.perf_counter()
+    handle = sys.stdout.buffer if output == "-" else open(output, "wb")
+    try:
+        for piece in export_stream(db.session, source, fmt, app.json.dumps, compress=compress,
+                                   chunk_rows=app.config["STREAM_CHUNK_SIZE"]):
+            handle.write(piece)
+    finally:
+        if handle is not sys.stdout.buffer:
+            handle.close()
+    click.echo(f"Exported {source} in {time.perf_counter() - started:.2f}s", err=True)
+
+
+@app.cli.command("sync-replicas")
+def sync_replicas_command():
+    """Copy a SQLite primary over its SQLite replicas, to try DATABASE_REPLICA_URLS locally."""
+    replica_urls = [bind["url"] for key, bind in app.config["SQLALCHEMY_BINDS"].items() if key.startswith(REPLICA_PREFIX)]
+    if not replica_urls:
+        raise click.ClickException("DATABASE_REPLICA_URLS is not set")
+    try:
+        paths = copy_sqlite_primary(app.config["SQLALCHEMY_DATABASE_URI"], replica_urls)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Copied the primary to {', '.join(paths)}")
+
+
+@app.cli.command("check-filter-indexes")
+def check_filter_indexes_command():
+    """Fail unless every filterable and sortable field has an index in the database (run after migrating)."""
+    missing = {}
+    with db.engine.connect() as connection:
+        for model in LISTABLE_MODELS:
+            fields = unindexed_filters(model, database_indexes(connection, model.__tablename__))
+            if fields:
+                missing[model.__tablename__] = fields
+    for table, fields in missing.items():
+        click.echo(f"{table}: no index on {', '.join(fields)}", err=True)
+    if missing:
+        raise SystemExit(1)
+    click.echo("Every filter and sort is index-backed.")
+
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
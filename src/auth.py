@@ -0,0 +1,70 @@
+"""
+Stateless HMAC-signed access and refresh tokens. Passwords are checked once
+at login; protected routes only verify a token signature, without touching
+bcrypt or the database.
+"""
+from functools import wraps
+from flask import request, current_app, g
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from utils import APIException
+
+# Defaults shipped in admin.py and .env.example: public, so anyone could mint tokens with them
+PLACEHOLDER_KEYS = {"sample key", "any key works"}
+
+TOKEN_TTL_CONFIG = {
+    "access": "ACCESS_TOKEN_TTL",
+    "refresh": "REFRESH_TOKEN_TTL",
+}
+
+
+def signing_key_configured(app):
+    return bool(app.secret_key) and app.secret_key not in PLACEHOLDER_KEYS
+
+
+def _serializer(token_type):
+    if not signing_key_configured(current_app):
+        # Refuse to issue or accept tokens rather than sign them with a public key
+        raise APIException("Token signing is not configured: set FLASK_APP_KEY", status_code=500)
+    # A distinct salt per type keeps a refresh token from being accepted as an access token
+    return URLSafeTimedSerializer(current_app.secret_key, salt=f"auth-{token_type}")
+
+
+def issue_tokens(user_id):
+    return {
+        "access_token": _serializer("access").dumps({"sub": user_id}),
+        "refresh_token": _serializer("refresh").dumps({"sub": user_id}),
+        "expires_in": current_app.config["ACCESS_TOKEN_TTL"],
+    }
+
+
+def decode_token(token, token_type):
+    """Return the user id a token was issued for, or raise a 401 APIException."""
+    if not isinstance(token, str):
+        raise APIException("Invalid token", status_code=401)
+    max_age = current_app.config[TOKEN_TTL_CONFIG[token_type]]
+    try:
+        claims = _serializer(token_type).loads(token, max_age=max_age)
+    except SignatureExpired:
+        raise APIException("Token has expired", status_code=401)
+    except BadSignature:
+        raise APIException("Invalid token", status_code=401)
+    return claims["sub"]
+
+
+def token_required(view):
+    """Require a valid access token; routes with a user_id argument only accept that user's token."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        authenticate(kwargs.get("user_id"))
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def authenticate(user_id=None):
+    """Check the request's bearer token and set g.user_id; with a user_id, only that user's token is accepted."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise APIException("Missing bearer token", status_code=401)
+    g.user_id = decode_token(token, "access")
+    if user_id is not None and user_id != g.user_id:
+        raise APIException("Token does not grant access to this user", status_code=403)
@@ -0,0 +1,159 @@
+"""
+In-process LRU + TTL cache for serialized entities and collection pages.
+Entries are invalidated from SQLAlchemy session commits, so a worker never
+serves an entity it has itself written; other workers see the change once
+their copy expires (CACHE_TTL).
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from utils import make_etag, last_modified_of, field_columns, serialize_item
+from replicas import reading_from_replica
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # model name -> number of invalidations, to spot loads that raced a commit
+        self._generations = {}
+        # model name -> time of the last invalidation, and how long replicas may lag behind it
+        self._invalidated_at = {}
+        self.replica_lag = 0
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, model_name):
+        with self._lock:
+            return self._generations.get(model_name, 0)
+
+    def set(self, key, value, generation=None):
+        """Store a value. With the generation read before loading it, the value is dropped
+        if the model was invalidated meanwhile, since it may predate that write."""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and self._generations.get(key[0], 0) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is None:
+            generation = self.generation(key[0])
+            value = loader()
+            if value is not None and not self._may_be_lagging(key[0]):
+                self.set(key, value, generation)
+        return value
+
+    def _may_be_lagging(self, model_name):
+        # A replica read soon after a local write may predate it: serve it, don't keep it
+        if not reading_from_replica():
+            return False
+        with self._lock:
+            invalidated_at = self._invalidated_at.get(model_name)
+        return invalidated_at is not None and time.monotonic() - invalidated_at < self.replica_lag
+
+    def invalidate(self, model_name, ids=None):
+        """Drop every collection page of a model and the given entity ids (all of them if ids is None)."""
+        with self._lock:
+            self._generations[model_name] = self._generations.get(model_name, 0) + 1
+            self._invalidated_at[model_name] = time.monotonic()
+            for key in list(self._entries):
+                if key[0] != model_name:
+                    continue
+                if key[1] == "collection" or ids is None or key[1] in ids:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for model_name in self._generations:
+                self._generations[model_name] += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+read_cache = LRUCache()
+
+
+def cached_entity(session, model, item_id, fields=None):
+    """Return {"data", "etag", "last_modified"} for an entity, from cache when possible, or None if it does not exist.
+    With a fieldset only those columns (plus the timestamps used for validators) are read."""
+    def load():
+        if fields is None:
+            item = session.get(model, item_id)
+        else:
+            columns = field_columns(model, fields, "created_at", "updated_at")
+            item = session.execute(select(*columns).where(model.id == item_id)).first()
+        if item is None:
+            return None
+        last_modified = last_modified_of(item)
+        return {
+            "data": serialize_item(item, fields),
+            "etag": make_etag(model.__name__, item_id, last_modified, fields),
+            "last_modified": last_modified,
+        }
+    return read_cache.get_or_load((model.__name__, item_id, fields), load)
+
+
+def setup_cache(app):
+    read_cache.max_entries = app.config['CACHE_MAX_ENTRIES']
+    read_cache.ttl = app.config['CACHE_TTL']
+    read_cache.replica_lag = app.config['REPLICA_MAX_LAG']
+
+    @event.listens_for(Session, "after_flush")
+    def collect_changes(session, flush_context):
+        changes = session.info.setdefault("cache_changes", {})
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            identity = inspect(obj).identity
+            ids = changes.setdefault(type(obj).__name__, set())
+            if identity is not None and ids is not None:
+                ids.add(identity[0])
+
+    @event.listens_for(Session, "do_orm_execute")
+    def collect_bulk_changes(orm_execute_state):
+        # Set-based insert/update/delete statements skip the flush, so drop the whole model
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            mapper = orm_execute_state.bind_mapper
+            if mapper is not None:
+                changes = orm_execute_state.session.info.setdefault("cache_changes", {})
+                changes[mapper.class_.__name__] = None
+
+    @event.listens_for(Session, "after_commit")
+    def invalidate_changes(session):
+        for model_name, ids in session.info.pop("cache_changes", {}).items():
+            read_cache.invalidate(model_name, ids)
+
+    @event.listens_for(Session, "after_rollback")
+    def discard_changes(session):
+        session.info.pop("cache_changes", None)
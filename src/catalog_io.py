@@ -0,0 +1,222 @@
+"""
+Bulk import and export of planet, character and starship catalogs. Dumps are
+parsed incrementally (JSON arrays, NDJSON or CSV) and upserted on the primary
+key in chunks; exports stream rows from a server-side cursor. Either way a
+table of any size runs in bounded memory.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy import func, insert, text, select, literal, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import User, Favorite, Planet, Character, Starship, FAVORITE_ITEM_TYPES
+from utils import coerce_to_column
+
+# catalog name -> (model, importable columns besides id)
+CATALOGS = {
+    "planets": (Planet, ("name", "mass", "description")),
+    "characters": (Character, ("name", "description")),
+    "starships": (Starship, ("name", "speed", "faction", "status")),
+}
+
+
+def iter_json_array(handle, read_size=1 << 16):
+    """Yield the elements of a top-level JSON array one at a time without reading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer, position, started = "", 0, False
+    while True:
+        chunk = handle.read(read_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("expected a JSON array of objects")
+                started, position = True, position + 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break  # the element continues in the next chunk
+            if chunk and (end == len(buffer) or buffer[end] not in " \t\r\n,]"):
+                break  # a number cut at "-0." or "1e" decodes short: wait for what follows it
+            position = end
+            yield item
+        if not chunk:
+            raise ValueError("unexpected end of file inside the JSON array")
+
+
+def iter_ndjson(handle):
+    for line in handle:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_records(handle, fmt):
+    if fmt == "csv":
+        return csv.DictReader(handle)
+    if fmt == "ndjson":
+        return iter_ndjson(handle)
+    return iter_json_array(handle)
+
+
+def clean_record(model, columns, record, number):
+    """Keep the known columns and coerce CSV strings to the column types."""
+    if not isinstance(record, dict) or not record.get("name"):
+        raise ValueError(f"record {number}: every record must be an object with a name")
+    row = {}
+    for name in ("id",) + columns:
+        value = record.get(name)
+        try:
+            row[name] = coerce_to_column(model.__table__.c[name], None if value == "" else value)
+        except ValueError as error:
+            raise ValueError(f"record {number}: {error}")
+    return row
+
+
+def upsert_chunk(session, model, columns, rows):
+    """Insert rows, updating existing ones with the same id (ON CONFLICT ... DO UPDATE)."""
+    table = model.__table__
+    keyed = [row for row in rows if row["id"] is not None]
+    unkeyed = [{name: row[name] for name in columns} for row in rows if row["id"] is None]
+    dialect = session.get_bind().dialect.name
+    if keyed:
+        if dialect in ("postgresql", "sqlite"):
+            stmt = (postgresql_insert if dialect == "postgresql" else sqlite_insert)(table)
+            updates = {name: stmt.excluded[name] for name in columns}
+            updates["updated_at"] = func.now()
+            stmt = stmt.on_conflict_do_update(index_elements=["id"], set_=updates)
+        else:
+            stmt = insert(table)
+        session.execute(stmt, keyed)
+    if unkeyed:
+        session.execute(insert(table), unkeyed)
+
+
+def copy_upsert_chunk(session, model, columns, rows):
+    """Postgres fast path: COPY the chunk into a temporary table, then upsert from it in one statement."""
+    table = model.__tablename__
+    names = ("id",) + columns
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([[row[name] for name in names] for row in rows])
+    buffer.seek(0)
+    assignments = ", ".join(f"{name} = EXCLUDED.{name}" for name in columns)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table}_import "
+                       f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        cursor.copy_expert(f"COPY {table}_import ({', '.join(names)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f"INSERT INTO {table} ({', '.join(names)}) SELECT {', '.join(names)} FROM {table}_import "
+                       f"ON CONFLICT (id) DO UPDATE SET {assignments}, updated_at = now()")
+    finally:
+        cursor.close()
+
+
+def import_catalog(session, catalog, records, chunk_size=1000, use_copy=True, progress=None):
+    """Upsert every record into the catalog's table, committing once per chunk. Returns the row count."""
+    model, columns = CATALOGS[catalog]
+    copy = use_copy and session.get_bind().dialect.name == "postgresql"
+    total, chunk = 0, []
+
+    def flush():
+        # One statement cannot upsert the same id twice on Postgres ("cannot affect row a second
+        # time"), so a chunk keeps the last record of each id, as importing them in turn would
+        rows = list({row["id"]: row for row in chunk if row["id"] is not None}.values())
+        rows += [row for row in chunk if row["id"] is None]
+        # COPY needs every row keyed; chunks with new rows go through the upsert statement
+        if copy and all(row["id"] is not None for row in rows):
+            copy_upsert_chunk(session, model, columns, rows)
+        else:
+            upsert_chunk(session, model, columns, rows)
+        session.commit()
+        if progress:
+            progress(total)
+
+    for number, record in enumerate(records, start=1):
+        chunk.append(clean_record(model, columns, record, number))
+        total += 1
+        if len(chunk) >= chunk_size:
+            flush()
+            chunk = []
+    if chunk:
+        flush()
+    if session.get_bind().dialect.name == "postgresql":
+        # Explicit ids do not advance the id sequence; move it past the imported rows
+        table = model.__tablename__
+        session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                             f"COALESCE((SELECT MAX(id) FROM {table}), 1))"))
+        session.commit()
+    return total
+
+
+EXPORT_SOURCES = sorted(CATALOGS) + ["favorites"]
+FAVORITE_EXPORT_COLUMNS = ("user_id", "username", "item_type", "item_id", "item_name")
+
+
+def export_query(source):
+    """Column names and the select for an export source. "favorites" is the flattened
+    user -> favorite item relation, one row per (user, item), read in a single pass."""
+    if source in CATALOGS:
+        model, _ = CATALOGS[source]
+        columns = model.serialized_fields
+        return columns, select(*[model.__table__.c[name] for name in columns]).order_by(model.__table__.c.id)
+    parts = []
+    for item_type, (model, column) in FAVORITE_ITEM_TYPES.items():
+        parts.append(
+            select(User.id.label("user_id"), User.username.label("username"),
+                   literal(item_type).label("item_type"), model.id.label("item_id"),
+                   model.name.label("item_name"))
+            .join(Favorite, Favorite.user_id == User.id)
+            .join(column.table, column.table.c.favorite_id == Favorite.id)
+            .join(model, model.id == column))
+    query = union_all(*parts).subquery()
+    return FAVORITE_EXPORT_COLUMNS, select(query).order_by(query.c.user_id, query.c.item_type, query.c.item_id)
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return (value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value).isoformat()
+    return value
+
+
+def export_stream(session, source, fmt, dumps, compress=False, chunk_rows=1000, flush_bytes=1 << 16):
+    """Yield the export as bytes: NDJSON or CSV, optionally gzip-compressed, in ~flush_bytes pieces."""
+    columns, stmt = export_query(source)
+    rows = session.execute(stmt.execution_options(yield_per=chunk_rows))
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip container
+
+    def encode(text_chunk):
+        data = text_chunk.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+    for row in rows:
+        if writer:
+            writer.writerow([_csv_value(value) for value in row])
+        else:
+            buffer.write(dumps(dict(zip(columns, row))) + "\n")
+        if buffer.tell() >= flush_bytes:
+            piece = encode(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+            if piece:
+                yield piece
+    tail = encode(buffer.getvalue())
+    if compressor:
+        tail += compressor.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,71 @@
+"""
+Prometheus metrics per Flask endpoint: request latency, status counts,
+response sizes, and the SQL statements and database time spent per request.
+With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by all of them so /metrics aggregates every worker.
+"""
+import os
+from time import perf_counter
+from flask import request, g, has_request_context, Response
+from prometheus_client import (Counter, Histogram, CollectorRegistry, REGISTRY,
+                               generate_latest, CONTENT_TYPE_LATEST, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by endpoint",
+    ["endpoint", "method"])
+REQUEST_COUNT = Counter(
+    "http_requests_total", "Requests by endpoint and status code",
+    ["endpoint", "method", "status"])
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size by endpoint",
+    ["endpoint"], buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements issued per request",
+    ["endpoint"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+DB_TIME = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL per request",
+    ["endpoint"])
+
+
+def _endpoint():
+    return request.endpoint or "unmatched"
+
+
+def setup_metrics(app):
+    @event.listens_for(Engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info["query_start"].pop()
+        if has_request_context():
+            g.db_time = g.get("db_time", 0.0) + elapsed
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = _endpoint()
+        if "request_start" in g:
+            REQUEST_LATENCY.labels(endpoint, request.method).observe(perf_counter() - g.request_start)
+        REQUEST_COUNT.labels(endpoint, request.method, response.status_code).inc()
+        # Streamed responses have no length up front
+        if response.content_length is not None:
+            RESPONSE_SIZE.labels(endpoint).observe(response.content_length)
+        DB_QUERIES.labels(endpoint).observe(g.get("query_count", 0))
+        DB_TIME.labels(endpoint).observe(g.get("db_time", 0.0))
+        return response
+
+
+def metrics_response():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -1,18 +1,22 @@
 from __future__ import annotations
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Integer, Text, ForeignKey, DateTime, func, Column, Table
+from sqlalchemy import String, Boolean, Integer, Text, ForeignKey, DateTime, func, Column, Table, Index, select
 from sqlalchemy.orm import Mapped, mapped_column, relationship, DeclarativeBase
 from typing import List, Optional
-from flask_bcrypt import Bcrypt
-from app import app
+from passwords import password_hasher
+from utils import compile_serializer
+from replicas import RoutingSession
 
-bcrypt = Bcrypt(app)
-
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class User(db.Model):
     __tablename__ = "users"
+    # keys emitted by serialize(), selectable with ?fields=
+    serialized_fields = ("id", "username", "email", "is_active", "created_at", "updated_at")
+    # ?field=value filters (field_gte=... for the other operators) and ?sort= keys; all index-backed
+    filterable_fields = {"username": ("eq",)}
+    sortable_fields = ("id", "username")
 
     id: Mapped[int] = mapped_column(primary_key=True)
     username: Mapped[str] = mapped_column(
@@ -30,36 +34,40 @@ class User(db.Model):
     favorites: Mapped["Favorite"] = relationship(back_populates="user")
 
     def serialize(self) -> dict:
-        return {
-            "id":        self.id,
-            "username":  self.username,
-            "email":     self.email,
-            "is_active": self.is_active,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at,
-        }
+        return compile_serializer(self.serialized_fields)(self)
     
     #HASHEO DE CONTRASEÑA
     
     def set_password(self, password):
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        hashed_password = password_hasher.hash(password)
         self.password_hash=hashed_password
         return "contraseña hasheada guardada exitosamente"
         
     def check_password(self, password):
-        is_valid = bcrypt.check_password_hash(self.password_hash, password)
+        if not self.password_hash:
+            return False
+        is_valid = password_hasher.verify(self.password_hash, password)
         return is_valid
+    
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
         
 
 favorites_planets = Table (
     "favorites_planets",
     db.metadata,
-    Column("favorite_id",ForeignKey("favorites.id")),
-    Column("planets_id",ForeignKey("planets.id"))
+    Column("favorite_id",ForeignKey("favorites.id"),primary_key=True),
+    Column("planets_id",ForeignKey("planets.id"),primary_key=True,index=True)
 )
 
 class Planet(db.Model):
     __tablename__ = "planets"
+    # keys emitted by serialize(), selectable with ?fields=
+    serialized_fields = ("id", "name", "mass", "description", "created_at")
+    filterable_fields = {"name": ("eq",)}
+    sortable_fields = ("id", "name")
+    # (sort column, id): one index range scan serves both a filter and a keyset page
+    __table_args__ = (Index("ix_planets_name_id", "name", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -72,24 +80,23 @@ class Planet(db.Model):
 
     #Relations
     
-    def serialize(self):
-        return {
-            "id":        self.id,
-            "name":  self.name,
-            "mass":     self.mass,
-            "description": self.description,
-            "created_at": self.created_at
-        }
+    def serialize(self) -> dict:
+        return compile_serializer(self.serialized_fields)(self)
 
 favorites_characters = Table (
     "favorites_characters",
     db.metadata,
-    Column("favorite_id",ForeignKey("favorites.id")),
-    Column("characters_id",ForeignKey("characters.id"))
+    Column("favorite_id",ForeignKey("favorites.id"),primary_key=True),
+    Column("characters_id",ForeignKey("characters.id"),primary_key=True,index=True)
 )
 
 class Character(db.Model):
     __tablename__ = "characters"
+    # keys emitted by serialize(), selectable with ?fields=
+    serialized_fields = ("id", "name", "description", "created_at", "updated_at")
+    filterable_fields = {"name": ("eq",)}
+    sortable_fields = ("id", "name")
+    __table_args__ = (Index("ix_characters_name_id", "name", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -101,31 +108,32 @@ class Character(db.Model):
     
     #Relations
     
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "description": self.description,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at
-        }
+    def serialize(self) -> dict:
+        return compile_serializer(self.serialized_fields)(self)
 
 favorites_starships = Table (
     "favorites_starships",
     db.metadata,
-    Column("favorite_id",ForeignKey("favorites.id")),
-    Column("starship_id",ForeignKey("starships.id"))
+    Column("favorite_id",ForeignKey("favorites.id"),primary_key=True),
+    Column("starship_id",ForeignKey("starships.id"),primary_key=True,index=True)
 )
 
 
 class Starship(db.Model):
     __tablename__ = "starships"
+    # keys emitted by serialize(), selectable with ?fields=
+    serialized_fields = ("id", "name", "speed", "faction", "status", "created_at", "updated_at")
+    filterable_fields = {"name": ("eq",), "faction": ("eq",), "status": ("eq",),
+                         "speed": ("eq", "gt", "gte", "lt", "lte")}
+    sortable_fields = ("id", "name", "speed")
+    __table_args__ = (Index("ix_starships_name_id", "name", "id"),
+                      Index("ix_starships_speed_id", "speed", "id"))
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(100), nullable=False)
     speed: Mapped[Optional[int]]
-    faction: Mapped[Optional[str]] = mapped_column(String(50))
-    status: Mapped[Optional[str]] = mapped_column(String(30))
+    faction: Mapped[Optional[str]] = mapped_column(String(50), index=True)
+    status: Mapped[Optional[str]] = mapped_column(String(30), index=True)
     created_at: Mapped[Optional[DateTime]] = mapped_column(
         DateTime, server_default=func.now())
     updated_at: Mapped[Optional[DateTime]] = mapped_column(
@@ -133,32 +141,25 @@ class Starship(db.Model):
     
     #Relations
     
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "speed": self.speed,
-            "faction": self.faction,
-            "status": self.status,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at
-        }
+    def serialize(self) -> dict:
+        return compile_serializer(self.serialized_fields)(self)
 
 class Favorite(db.Model):
     __tablename__ = "favorites"
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(
-        ForeignKey("users.id"), nullable=False)
+        ForeignKey("users.id"), nullable=False, unique=True, index=True)
     created_at: Mapped[Optional[DateTime]] = mapped_column(
         DateTime, server_default=func.now())
 
     #Relationships
     
     user: Mapped["User"] = relationship(back_populates="favorites")
-    planets:Mapped[List[Planet]]=relationship(secondary=favorites_planets)
-    characters:Mapped[List[Character]]=relationship(secondary=favorites_characters)
-    starships:Mapped[List[Starship]]=relationship(secondary=favorites_starships)
+    # selectin: one extra IN query per collection, no matter how many favorites a user has
+    planets:Mapped[List[Planet]]=relationship(secondary=favorites_planets, lazy="selectin")
+    characters:Mapped[List[Character]]=relationship(secondary=favorites_characters, lazy="selectin")
+    starships:Mapped[List[Starship]]=relationship(secondary=favorites_starships, lazy="selectin")
 
     
 
@@ -170,4 +171,37 @@ class Favorite(db.Model):
             "characters": [character.serialize() for character in self.characters],
             "starships": [starship.serialize() for starship in self.starships],
             "created_at": self.created_at
-        }
\ No newline at end of file
+        }
+
+
+def favorites_for_user(user_id):
+    """Select a user's Favorite row, refreshing it and its collections even if already in the session."""
+    return select(Favorite).where(Favorite.user_id == user_id).execution_options(populate_existing=True)
+
+
+# item_type used in the favorites URLs -> (model, association table column holding its id)
+FAVORITE_ITEM_TYPES = {
+    "planet": (Planet, favorites_planets.c.planets_id),
+    "character": (Character, favorites_characters.c.characters_id),
+    "starship": (Starship, favorites_starships.c.starship_id),
+}
+
+# collection name in a favorites payload -> item_type
+FAVORITE_COLLECTIONS = {f"{item_type}s": item_type for item_type in FAVORITE_ITEM_TYPES}
+
+
+def favorite_collections(session, user_id, collections):
+    """Serialized favorite items of a user for each requested collection ("planets", ...).
+    One Core query per collection, however many items the user has favorited."""
+    result = {}
+    for name in collections:
+        model, column = FAVORITE_ITEM_TYPES[FAVORITE_COLLECTIONS[name]]
+        fields = model.serialized_fields
+        stmt = (select(*[model.__table__.c[field] for field in fields])
+                .join(column.table, column == model.id)
+                .join(Favorite, Favorite.id == column.table.c.favorite_id)
+                .where(Favorite.user_id == user_id)
+                .order_by(model.id))
+        serializer = compile_serializer(fields)
+        result[name] = [serializer(row) for row in session.execute(stmt)]
+    return result
@@ -0,0 +1,50 @@
+"""
+bcrypt hashing and verification on a bounded worker pool. bcrypt releases the
+GIL, so the pool lets several logins hash in parallel, while the bounded
+queue sheds load with a 503 instead of letting requests pile up behind it.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from flask_bcrypt import Bcrypt
+from utils import APIException
+
+bcrypt = Bcrypt()
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.rounds = 12
+        self._executor = None
+        self._slots = None
+
+    def init_app(self, app):
+        bcrypt.init_app(app)
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # Slots for the running jobs plus the ones allowed to wait for a worker
+        self._slots = BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE'])
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise APIException("Too many password operations in progress, try again shortly", status_code=503)
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def verify(self, password_hash, password):
+        return self._run(bcrypt.check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        return int(password_hash.split("$")[2]) != self.rounds
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,74 @@
+"""
+Connection pool configuration from the environment, plus a QueuePool that
+records how long requests wait for a connection so exhaustion shows up in
+/pool/stats before it shows up as latency.
+"""
+import os
+from time import perf_counter
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            self.checkouts += 1
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def stats(self):
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.checkouts,
+            "avg_wait_ms": round(self.wait_time / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait_time * 1000, 3),
+            "timeouts": self.timeouts,
+        }
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URI. Defaults give each gunicorn worker one
+    pooled connection per thread (WORKER_THREADS) and the same again as overflow."""
+    if database_uri.startswith("sqlite") and (":memory:" in database_uri or database_uri.endswith("://")):
+        return {}  # in-memory SQLite must keep its single-connection pool
+
+    threads = int(os.getenv("WORKER_THREADS", 1))
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", threads)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", threads)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") not in ("0", "false"),
+    }
+    statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout and database_uri.startswith("postgresql"):
+        options["connect_args"] = {"options": f"-c statement_timeout={int(statement_timeout)}"}
+    return options
+
+
+def pool_stats(engines):
+    """Pool stats for every engine, keyed by bind name ("default" for the main one)."""
+    stats = {}
+    for name, engine in engines.items():
+        pool = engine.pool
+        stats[name or "default"] = pool.stats() if isinstance(pool, InstrumentedQueuePool) else {"status": pool.status()}
+    return stats
@@ -0,0 +1,78 @@
+"""
+Read-replica routing. DATABASE_REPLICA_URLS lists replica databases, which
+become SQLAlchemy binds named replica_0, replica_1, ... Views marked
+@read_replica read from one of them, picked round-robin once per request;
+every other view, and everything after the first write within a request,
+uses the primary. Two SQLite files are enough to try it locally:
+
+    DATABASE_URL=sqlite:////tmp/primary.db DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db
+    flask sync-replicas   # copies the primary file over each replica file
+
+Replicas are never migrated or written to by the app; keeping them in sync
+is up to the database. For REPLICA_MAX_LAG seconds after this worker commits
+a change to a model, replica reads of that model are not stored in the read
+cache, so replication lag is not stretched to CACHE_TTL.
+"""
+import itertools
+import sqlite3
+from functools import wraps
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+from pool import engine_options
+
+REPLICA_PREFIX = "replica_"
+
+_round_robin = itertools.count()
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a comma-separated list of replica URLs."""
+    binds = {}
+    for url in filter(None, (url.strip() for url in urls.split(","))):
+        url = url.replace("postgres://", "postgresql://")
+        binds[f"{REPLICA_PREFIX}{len(binds)}"] = {"url": url, **engine_options(url)}
+    return binds
+
+
+def reading_from_replica():
+    return has_request_context() and bool(g.get("replica_bind"))
+
+
+def copy_sqlite_primary(primary_url, replica_urls):
+    """Copy a SQLite primary over each SQLite replica with the online backup API, standing in
+    for replication when trying replicas locally. Returns the replica file paths."""
+    urls = [make_url(primary_url)] + [make_url(url) for url in replica_urls]
+    if any(url.get_backend_name() != "sqlite" or not url.database for url in urls):
+        raise ValueError("only SQLite files can be copied; other databases replicate themselves")
+    paths = []
+    with sqlite3.connect(urls[0].database) as source:
+        for url in urls[1:]:
+            with sqlite3.connect(url.database) as target:
+                source.backup(target)
+            paths.append(url.database)
+    return paths
+
+
+def read_replica(view):
+    """Serve a read-only view from a replica when any are configured. Place it under @query_budget."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replicas = [key for key in current_app.config.get("SQLALCHEMY_BINDS", {}) if key.startswith(REPLICA_PREFIX)]
+        if replicas:
+            g.replica_bind = replicas[next(_round_robin) % len(replicas)]
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Sends reads to the request's replica until the session writes, then sticks to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get("replica_bind"):
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.pop("replica_bind")  # read-after-write in this request must see the write
+            else:
+                return self._db.engines[g.replica_bind]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,107 @@
+"""
+Full-text search over planets, characters and starships.
+SQLite uses FTS5 external-content tables kept in sync by triggers; Postgres
+uses a generated tsvector column with a GIN index. Either way the index is
+maintained by the database itself, so every create/delete path (including
+bulk inserts) stays searchable without application code.
+"""
+from sqlalchemy import DDL, event, select, text
+from models import Planet, Character, Starship
+
+# kind reported in results -> (model, indexed columns)
+SEARCHABLE = {
+    "planet": (Planet, ["name", "description"]),
+    "character": (Character, ["name", "description"]),
+    "starship": (Starship, ["name", "faction", "status"]),
+}
+
+
+def sqlite_ddl(table, columns):
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5({cols}, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {table}_fts(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {table}_fts({table}_fts, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {table}_fts({table}_fts, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {table}_fts(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')",
+    ]
+
+
+def postgres_ddl(table, columns):
+    document = " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('english', {document})) STORED",
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING gin (search_vector)",
+    ]
+
+
+# db.create_all() builds the index too; migrations create it for existing databases
+for _model, _columns in SEARCHABLE.values():
+    for _statement in sqlite_ddl(_model.__tablename__, _columns):
+        event.listen(_model.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+    for _statement in postgres_ddl(_model.__tablename__, _columns):
+        event.listen(_model.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
+
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic autogenerate filter. The search index is created by DDL outside the models' metadata
+    (FTS5 tables on SQLite, the search_vector column and its GIN index on Postgres), so autogenerate
+    must not see it as something to drop."""
+    tables = [model.__tablename__ for model, _ in SEARCHABLE.values()]
+    if type_ == "table":
+        return not any(name == f"{table}_fts" or name.startswith(f"{table}_fts_") for table in tables)
+    if type_ == "column":
+        return name != "search_vector"
+    if type_ == "index":
+        return name not in {f"ix_{table}_search_vector" for table in tables}
+    return True
+
+def _fts5_query(q):
+    # Quote every term so user input can never be parsed as FTS5 query syntax
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+
+def _ranked_ids_sql(dialect):
+    parts = []
+    for kind, (model, _) in SEARCHABLE.items():
+        table = model.__tablename__
+        if dialect == "sqlite":
+            parts.append(
+                f"SELECT '{kind}' AS kind, rowid AS id, -bm25({table}_fts) AS score "
+                f"FROM {table}_fts WHERE {table}_fts MATCH :q")
+        else:
+            parts.append(
+                f"SELECT '{kind}' AS kind, id, ts_rank(search_vector, websearch_to_tsquery('english', :q)) AS score "
+                f"FROM {table} WHERE search_vector @@ websearch_to_tsquery('english', :q)")
+    return text(" UNION ALL ".join(parts) + " ORDER BY score DESC, kind, id LIMIT :limit OFFSET :offset")
+
+
+def search(session, q, limit, offset=0):
+    """Ranked hits across every searchable model, plus the offset of the next page (or None)."""
+    dialect = session.get_bind().dialect.name
+    params = {"q": _fts5_query(q) if dialect == "sqlite" else q, "limit": limit + 1, "offset": offset}
+    ranked = session.execute(_ranked_ids_sql(dialect), params).all()
+    next_offset = offset + limit if len(ranked) > limit else None
+    ranked = ranked[:limit]
+
+    # One IN query per kind to load the matched rows
+    items = {}
+    for kind, (model, _) in SEARCHABLE.items():
+        ids = [row.id for row in ranked if row.kind == kind]
+        if ids:
+            for item in session.scalars(select(model).where(model.id.in_(ids))):
+                items[(kind, item.id)] = item.serialize()
+
+    hits = [
+        {"type": row.kind, "id": row.id, "score": row.score, "item": items[(row.kind, row.id)]}
+        for row in ranked if (row.kind, row.id) in items
+    ]
+    return hits, next_offset
@@ -0,0 +1,101 @@
+"""
+Opt-in slow-query recorder. With SLOW_QUERY_MS set, every statement slower
+than the threshold is logged with its (redacted) parameters, duration,
+originating Flask endpoint and the database's query plan, and kept in a
+ring buffer shown in the admin panel.
+"""
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from threading import Lock
+from time import perf_counter
+from flask import request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("slow_queries")
+
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+
+class SlowQueryLog:
+    def __init__(self):
+        self.threshold = None
+        self.entries = deque(maxlen=100)
+        self._lock = Lock()
+
+    def record(self, entry):
+        with self._lock:
+            self.entries.appendleft(entry)
+
+    def recent(self):
+        with self._lock:
+            return list(self.entries)
+
+
+slow_query_log = SlowQueryLog()
+
+
+def redact(parameters):
+    """Keep the shape and types of bound parameters, never their values."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) if isinstance(value, (dict, list, tuple)) else type(value).__name__
+                for value in parameters]
+    return type(parameters).__name__
+
+
+def explain(cursor, dialect_name, statement, parameters):
+    # A separate DBAPI cursor on the same connection, so the plan matches the
+    # transaction's view and no SQLAlchemy events fire for the EXPLAIN itself.
+    # Outside SQLite a savepoint keeps a failed EXPLAIN from aborting the transaction.
+    sqlite = dialect_name == "sqlite"
+    explain_cursor = cursor.connection.cursor()
+    try:
+        if not sqlite:
+            explain_cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            explain_cursor.execute(("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ") + statement, parameters)
+            plan = "\n".join(" | ".join(str(col) for col in row) for row in explain_cursor.fetchall())
+        except Exception as error:
+            if not sqlite:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            return f"EXPLAIN failed: {error}"
+        if not sqlite:
+            explain_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    finally:
+        explain_cursor.close()
+
+
+def setup_slow_query_log(app):
+    threshold_ms = app.config['SLOW_QUERY_MS']
+    if threshold_ms is None:
+        return
+    slow_query_log.threshold = threshold_ms / 1000
+    slow_query_log.entries = deque(maxlen=app.config['SLOW_QUERY_BUFFER'])
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def record_slow_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info["slow_query_start"].pop()
+        if elapsed < slow_query_log.threshold:
+            return
+        plan = None
+        if not executemany and statement.lstrip().lower().startswith(EXPLAINABLE):
+            plan = explain(cursor, conn.dialect.name, statement, parameters)
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(elapsed * 1000, 2),
+            "endpoint": request.endpoint if has_request_context() else None,
+            "statement": statement,
+            "parameters": redact(parameters),
+            "plan": plan,
+        }
+        slow_query_log.record(entry)
+        logger.warning("slow query (%.1f ms) on %s: %s\n%s",
+                       entry["duration_ms"], entry["endpoint"], statement, plan or "")
@@ -1,4 +1,24 @@
-from flask import jsonify, url_for
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import operator
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from operator import attrgetter
+from flask.json.provider import DefaultJSONProvider
+from flask import jsonify, url_for, request, current_app, Response, stream_with_context, g, has_request_context
+from sqlalchemy import select, insert, event, func, inspect, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used instead
+    orjson = None
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +35,426 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def _json_default(obj):
+    # Timestamps are stored naive in UTC; emit them as ISO-8601 with an explicit offset
+    if isinstance(obj, datetime):
+        return (obj.replace(tzinfo=timezone.utc) if obj.tzinfo is None else obj).isoformat()
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider using orjson when it is installed, with the same ISO-8601 datetime output either way."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC | orjson.OPT_SORT_KEYS).decode()
+        kwargs.setdefault("default", _json_default)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        return json.dumps(obj, **kwargs)
+
+@lru_cache(maxsize=None)
+def compile_serializer(fields):
+    """Build a function turning an ORM object or Row into a dict of the given fields, with one attrgetter call."""
+    getter = attrgetter(*fields)
+    if len(fields) == 1:
+        return lambda item: {fields[0]: getter(item)}
+    return lambda item: dict(zip(fields, getter(item)))
+
+def get_page_args(sort=None):
+    """Read ?limit= and ?after= from the query string, clamping limit to MAX_PAGE_SIZE.
+    With a sort, after is the opaque cursor returned as "next" instead of an id."""
+    try:
+        limit = int(request.args.get("limit", current_app.config["DEFAULT_PAGE_SIZE"]))
+        after = request.args.get("after")
+        if after is not None:
+            after = decode_cursor(after) if sort else int(after)
+    except ValueError:
+        raise APIException("limit must be an integer and after a cursor from a previous page", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+    return min(limit, current_app.config["MAX_PAGE_SIZE"]), after
+
+def get_fields(model):
+    """Parse ?fields=a,b into a tuple of serialized field names, or None when every field is wanted."""
+    raw = request.args.get("fields")
+    if not raw:
+        return None
+    fields = tuple(dict.fromkeys(name.strip() for name in raw.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in model.serialized_fields]
+    if unknown:
+        raise APIException(f"Unknown fields: {', '.join(unknown)}", status_code=400,
+                           payload={"allowed": list(model.serialized_fields)})
+    return fields or None
+
+# ?<field>_<op>=value suffixes; a bare ?<field>=value is "eq"
+FILTER_OPERATORS = {"eq": operator.eq, "gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+# query parameters with their own meaning on collection endpoints
+RESERVED_ARGS = {"limit", "after", "fields", "ids", "sort", "format", "stream"}
+
+def get_list_args(model):
+    """Parse the whitelisted filters (?faction=Empire&speed_gte=1000) and ?sort=-speed of a collection.
+    Returns (filters, sort): filters is a sorted tuple of (field, op, value) and sort a (field, descending)
+    pair or None, both hashable so they can be part of a cache key."""
+    filters = []
+    for key, raw in request.args.items(multi=True):
+        if key in RESERVED_ARGS:
+            continue
+        field, _, op = key.rpartition("_")
+        if op not in FILTER_OPERATORS or not field:
+            field, op = key, "eq"
+        if op not in model.filterable_fields.get(field, ()):
+            raise APIException(f"Unsupported filter: {key}", status_code=400,
+                               payload={"allowed": {name: list(ops) for name, ops in model.filterable_fields.items()}})
+        try:
+            value = model.__table__.c[field].type.python_type(raw)
+        except ValueError:
+            raise APIException(f"Invalid value for {key}", status_code=400)
+        filters.append((field, op, value))
+    sort = request.args.get("sort")
+    if sort:
+        field = sort.lstrip("-")
+        if field not in model.sortable_fields:
+            raise APIException(f"Unsupported sort: {sort}", status_code=400,
+                               payload={"allowed": list(model.sortable_fields)})
+        sort = (field, sort.startswith("-"))
+    return tuple(sorted(filters, key=repr)), sort or None
+
+def coerce_to_column(column, value):
+    """Coerce a JSON or CSV value to what a column stores: integers from ints or numeric strings,
+    strings from text or numbers within the column length. Raises ValueError naming the column."""
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is int:
+        if isinstance(value, (int, str)) and not isinstance(value, bool):
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        raise ValueError(f"{column.name} must be an integer")
+    if python_type is str:
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f"{column.name} must be a string")
+        value = str(value)
+        if column.type.length is not None and len(value) > column.type.length:
+            raise ValueError(f"{column.name} must be at most {column.type.length} characters")
+    return value
+
+def encode_cursor(value, item_id):
+    return base64.urlsafe_b64encode(json.dumps([value, item_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError(f"invalid cursor: {cursor}")
+    return value, int(item_id)
+
+def unindexed_filters(model, indexes):
+    """Filterable or sortable fields of a model that no index in indexes serves. indexes are (column names,
+    unique) pairs: a filter needs an index led by its column, a sort one on (column, id) or a unique column."""
+    filters = {name for name in model.filterable_fields if not any(columns[:1] == (name,) for columns, _ in indexes)}
+    sorts = {name for name in model.sortable_fields
+             if not any(columns[:2] == (name, "id") or (unique and columns == (name,)) for columns, unique in indexes)}
+    return sorted(filters | sorts)
+
+def metadata_indexes(table):
+    """(column names, unique) of the primary key, unique columns and indexes declared on a table."""
+    indexes = [(tuple(column.name for column in table.primary_key.columns), True)]
+    indexes += [((column.name,), True) for column in table.columns if column.unique]
+    indexes += [(tuple(column.name for column in index.columns), bool(index.unique)) for index in table.indexes]
+    return indexes
+
+def database_indexes(connection, table_name):
+    """(column names, unique) of the primary key, unique constraints and indexes that exist in the database."""
+    inspector = inspect(connection)
+    indexes = [(tuple(inspector.get_pk_constraint(table_name)["constrained_columns"]), True)]
+    indexes += [(tuple(unique["column_names"]), True) for unique in inspector.get_unique_constraints(table_name)]
+    indexes += [(tuple(index["column_names"]), bool(index["unique"])) for index in inspector.get_indexes(table_name)
+                if all(index["column_names"])]
+    return indexes
+
+def get_includes(allowed):
+    """Parse ?include=a,a.b into a set of related paths, rejecting any not in allowed."""
+    raw = request.args.get("include")
+    if not raw:
+        return set()
+    includes = {name.strip() for name in raw.split(",") if name.strip()}
+    unknown = sorted(includes - set(allowed))
+    if unknown:
+        raise APIException(f"Unknown include: {', '.join(unknown)}", status_code=400,
+                           payload={"allowed": list(allowed)})
+    return includes
+
+def get_ids_arg():
+    """Parse ?ids=1,2,3 into a tuple of unique ids in the order given, or None when absent."""
+    raw = request.args.get("ids")
+    if raw is None:
+        return None
+    try:
+        ids = tuple(dict.fromkeys(int(part) for part in raw.split(",") if part.strip()))
+    except ValueError:
+        raise APIException("ids must be a comma-separated list of integers", status_code=400)
+    max_ids = current_app.config["MAX_BATCH_IDS"]
+    if not ids:
+        raise APIException("ids must not be empty", status_code=400)
+    if len(ids) > max_ids:
+        raise APIException(f"At most {max_ids} ids can be requested at once", status_code=413)
+    return ids
+
+def field_columns(model, fields, *extra):
+    """Table columns needed for a set of fields: the primary key, the requested fields and any extras."""
+    names = dict.fromkeys(("id",) + tuple(extra) + tuple(fields))
+    return [model.__table__.c[name] for name in names]
+
+def serialize_item(item, fields=None):
+    if fields is None:
+        return item.serialize()
+    return compile_serializer(fields)(item)
+
+def _collection_select(model, fields):
+    # Core select over the table columns: rows come back as plain Row tuples, never as ORM
+    # instances, so nothing is built, tracked or kept in the session's identity map
+    return select(*field_columns(model, fields or model.serialized_fields))
+
+def _list_selects(model, fields, filters=(), sort=None, after=None):
+    # Filtered selects positioned after the cursor, read in order until a page is full. A sorted
+    # listing orders by (sort column, id) in the sort direction and compares the cursor as a row
+    # value, so each select is a single range scan of the (column, id) index. Rows whose sort
+    # value is NULL never match that comparison; they come last, from a second select on the
+    # NULL end of the same index ordered by id, and their cursor is (None, id)
+    table = model.__table__
+    id_column = table.c.id
+    stmt = select(*field_columns(model, fields or model.serialized_fields, *(sort[:1] if sort else ())))
+    if filters:
+        stmt = stmt.where(*[FILTER_OPERATORS[op](table.c[field], value) for field, op, value in filters])
+    field, descending = sort or ("id", False)
+    column = table.c[field]
+    past = operator.lt if descending else operator.gt
+    ordered = operator.methodcaller("desc" if descending else "asc")
+    if column is id_column:
+        stmt = stmt.order_by(ordered(id_column))
+        last_id = after[1] if sort and after is not None else after
+        return [stmt.where(past(id_column, last_id)) if after is not None else stmt]
+    value, last_id = after if after is not None else (None, None)
+    selects = []
+    if after is None or value is not None:
+        present = stmt.where(column.is_not(None)) if column.nullable else stmt
+        if after is not None:
+            present = present.where(past(tuple_(column, id_column), (value, last_id)))
+        selects.append(present.order_by(ordered(column), ordered(id_column)))
+    if column.nullable:
+        missing = stmt.where(column.is_(None))
+        if value is None and last_id is not None:
+            missing = missing.where(past(id_column, last_id))
+        selects.append(missing.order_by(ordered(id_column)))
+    return selects
+
+def paginate(session, model, limit, after=None, fields=None, filters=(), sort=None):
+    """Keyset pagination on the primary key, or on (sort column, id) with a sort: returns (rows, next_cursor).
+    Ties on the sort column are broken by id in the same direction as the sort."""
+    rows = []
+    for stmt in _list_selects(model, fields, filters, sort, after):
+        rows += session.execute(stmt.limit(limit + 1 - len(rows))).all()
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            return rows[:limit], encode_cursor(getattr(last, sort[0]), last.id) if sort else last.id
+    return rows, None
+
+def collection_page(session, model, limit, after=None, fields=None, filters=(), sort=None):
+    """Response body for one page of a collection: serialized rows plus the next cursor."""
+    rows, next_cursor = paginate(session, model, limit, after, fields, filters, sort)
+    serializer = compile_serializer(fields or model.serialized_fields)
+    return {"results": [serializer(row) for row in rows], "next": next_cursor}
+
+def batch_get(session, model, ids, fields=None):
+    """Fetch many rows by id with one IN query. Results follow the requested order; absent ids are listed in "missing"."""
+    rows = session.execute(_collection_select(model, fields).where(model.__table__.c.id.in_(ids))).all()
+    by_id = {row.id: row for row in rows}
+    serializer = compile_serializer(fields or model.serialized_fields)
+    return {"results": [serializer(by_id[item_id]) for item_id in ids if item_id in by_id],
+            "missing": [item_id for item_id in ids if item_id not in by_id]}
+
+def get_stream_format():
+    """Return "ndjson" or "json" when the client asked for a streamed collection, otherwise None."""
+    best = request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+    if best == "application/x-ndjson" or request.args.get("format") == "ndjson":
+        return "ndjson"
+    if request.args.get("stream") in ("1", "true"):
+        return "json"
+    return None
+
+def stream_collection(session, model, stream_format, after=None, fields=None, filters=(), sort=None):
+    """Stream every row after the cursor, serializing one row at a time instead of building the whole payload."""
+    selects = [stmt.execution_options(yield_per=current_app.config["STREAM_CHUNK_SIZE"])
+               for stmt in _list_selects(model, fields, filters, sort, after)]
+    dumps = current_app.json.dumps
+    serializer = compile_serializer(fields or model.serialized_fields)
+
+    def generate():
+        rows = itertools.chain.from_iterable(session.execute(stmt) for stmt in selects)
+        if stream_format == "ndjson":
+            for row in rows:
+                yield dumps(serializer(row)) + "\n"
+            return
+        yield '{"results": ['
+        separator = ""
+        for row in rows:
+            yield separator + dumps(serializer(row))
+            separator = ","
+        yield "]}"
+
+    mimetype = "application/x-ndjson" if stream_format == "ndjson" else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+# bound parameters per bulk INSERT; SQLite allows 32766, Postgres 65535
+BULK_INSERT_MAX_PARAMS = 30000
+
+def bulk_insert(session, model, items, fields):
+    """Validate a JSON array of objects and insert all of them in one statement and one transaction.
+    Returns the new ids in the order the items were given."""
+    max_items = current_app.config["MAX_BULK_ITEMS"]
+    if not items:
+        raise APIException("Expected a non-empty list of items", status_code=400)
+    if len(items) > max_items:
+        raise APIException(f"At most {max_items} items can be created per request", status_code=413)
+    table = model.__table__
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("name"):
+            raise APIException("Every item must be an object with a name", status_code=400,
+                               payload={"index": index})
+        try:
+            rows.append({field: coerce_to_column(table.c[field], item.get(field)) for field in fields})
+        except ValueError as error:
+            raise APIException(f"Invalid item: {error}", status_code=400, payload={"index": index})
+    # One multi-row INSERT ... VALUES per chunk. An executemany with ordered RETURNING
+    # would fall back to one statement per row on SQLite. Chunks keep the bound
+    # parameters under SQLite's 32766 limit. Inserting through the model, not its table,
+    # lets the read cache see the statement and invalidate the model on commit.
+    chunk_size = max(1, BULK_INSERT_MAX_PARAMS // len(fields))
+    ids = []
+    for start in range(0, len(rows), chunk_size):
+        stmt = insert(model).values(rows[start:start + chunk_size]).returning(model.id)
+        # RETURNING order is unspecified, but ids within one statement are assigned in VALUES order
+        ids.extend(sorted(session.scalars(stmt).all()))
+    session.commit()
+    return ids
+
+def insert_ignoring_conflicts(session, table, index_elements):
+    """INSERT ... ON CONFLICT DO NOTHING on Postgres and SQLite, so concurrent writers of the same
+    key don't fail with IntegrityError. Other dialects get a plain INSERT."""
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql_insert if dialect == "postgresql" else sqlite_insert)(table)
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+    return insert(table)
+
+def make_etag(*parts):
+    return hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()
+
+def last_modified_of(item):
+    return item.updated_at or item.created_at
+
+def collection_etag(session, model, *variant):
+    """ETag for a collection, from one aggregate query instead of loading rows. variant tells apart
+    representations negotiated from headers, such as the streamed formats. Collections carry no
+    Last-Modified: deleting a row leaves the newest timestamp unchanged, but not the row count."""
+    count, last_updated, last_created = session.execute(
+        select(func.count(model.id), func.max(model.updated_at), func.max(model.created_at))).one()
+    return make_etag(model.__name__, count, last_updated, last_created, request.query_string.decode(), *variant)
+
+def _as_utc(value):
+    # Timestamps are stored naive in UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def is_fresh(etag, last_modified=None):
+    """True when the client's cached copy, as described by If-None-Match/If-Modified-Since, is current."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        return _as_utc(last_modified).replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _as_utc(last_modified)
+    return response
+
+def not_modified_response(etag, last_modified=None):
+    return with_validators(Response(status=304), etag, last_modified)
+
+def query_budget(limit):
+    """Declare the most SQL statements a view may issue per request. Place it right under @app.route."""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+def setup_query_counter(app):
+    """Count the SQL statements issued by each request and report them in the X-Query-Count header.
+    Requests going over their view's query_budget are logged and flagged with X-Query-Budget-Exceeded;
+    streamed responses are checked when the body has been sent."""
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.query_count = g.get("query_count", 0) + 1
+
+    def warn_over_budget(method, path, count, budget):
+        logging.getLogger("query_budget").warning(
+            "%s %s issued %d queries, budget is %d", method, path, count, budget)
+
+    @app.after_request
+    def add_query_count_header(response):
+        count = g.get("query_count", 0)
+        response.headers["X-Query-Count"] = str(count)
+        budget = getattr(app.view_functions.get(request.endpoint), "query_budget", None)
+        if budget is not None and count > budget:
+            response.headers["X-Query-Budget-Exceeded"] = f"{count}/{budget}"
+            warn_over_budget(request.method, request.path, count, budget)
+        elif budget is not None and response.is_streamed:
+            # A streamed body runs its queries after the headers are sent, so
+            # X-Query-Count only covers the view itself; check the total once it is drained
+            request_g, method, path = g._get_current_object(), request.method, request.path
+
+            def check_streamed_budget():
+                total = request_g.get("query_count", 0)
+                if total > budget:
+                    warn_over_budget(method, path, total, budget)
+            response.call_on_close(check_streamed_budget)
+        return response
+
+@contextmanager
+def count_queries():
+    """Collect every SQL statement executed inside the block: `with count_queries() as statements:`."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+def check_query_budget(app, client, method, url, **kwargs):
+    """Send one request through a Flask test client and raise AssertionError if its view
+    issues more statements than its declared query_budget. Returns the response."""
+    endpoint, _ = app.url_map.bind("localhost").match(url.split("?")[0], method=method)
+    budget = getattr(app.view_functions[endpoint], "query_budget", None)
+    with count_queries() as statements:
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()
+    if budget is not None and len(statements) > budget:
+        raise AssertionError(
+            f"{method} {url} ({endpoint}) issued {len(statements)} queries, budget is {budget}:\n"
+            + "\n".join(statements))
+    return response
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
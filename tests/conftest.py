@@ -0,0 +1,92 @@
+"""
+Fixtures for exercising the app through the Flask test client on a throwaway
+SQLite database, with a second SQLite file as its read replica. The app reads
+its configuration from the environment when it is imported, so the environment
+is set up here before anything imports it.
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_DIR = tempfile.mkdtemp(prefix="starwarsapi-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(DATABASE_DIR, "primary.db")
+os.environ["DATABASE_REPLICA_URLS"] = "sqlite:///" + os.path.join(DATABASE_DIR, "replica.db")
+os.environ.setdefault("FLASK_APP_KEY", os.urandom(16).hex())
+os.environ["BCRYPT_LOG_ROUNDS"] = "4"
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+PASSWORD = "correct horse"
+CATALOG_SIZE = 5
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import app
+    return app
+
+
+@pytest.fixture
+def seeded(app):
+    """A fresh schema with two users, CATALOG_SIZE rows per catalog and favorites for user 1,
+    copied to the replica."""
+    from sqlalchemy import insert
+    from cache import read_cache
+    from models import db, User, Planet, Character, Starship, Favorite, FAVORITE_ITEM_TYPES
+    from passwords import password_hasher
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = password_hasher.hash(PASSWORD)
+        db.session.execute(insert(User), [{"username": f"user{i}", "email": f"user{i}@example.com",
+                                           "password_hash": password_hash} for i in (1, 2)])
+        db.session.execute(insert(Planet), [{"name": f"Planet {i}", "mass": str(i), "description": "desert"}
+                                            for i in range(1, CATALOG_SIZE + 1)])
+        db.session.execute(insert(Character), [{"name": f"Character {i}", "description": "pilot"}
+                                               for i in range(1, CATALOG_SIZE + 1)])
+        db.session.execute(insert(Starship), [{"name": f"Starship {i}", "speed": i * 100, "faction": "Empire"}
+                                              for i in range(1, CATALOG_SIZE + 1)])
+        db.session.execute(insert(Favorite), [{"user_id": 1}])
+        for model, column in FAVORITE_ITEM_TYPES.values():
+            db.session.execute(insert(column.table), [{"favorite_id": 1, column.name: 1}])
+        db.session.commit()
+    sync_replicas(app)
+    read_cache.clear()
+    yield app
+
+
+def sync_replicas(app):
+    from models import db
+    from replicas import copy_sqlite_primary
+    with app.app_context():
+        db.engines[None].dispose()  # no pooled connection may hold the files mid-copy
+    copy_sqlite_primary(os.environ["DATABASE_URL"], os.environ["DATABASE_REPLICA_URLS"].split(","))
+
+
+@pytest.fixture
+def client(seeded):
+    return seeded.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    """Authorization headers carrying an access token for a user id."""
+    from auth import issue_tokens
+
+    def headers(user_id=1):
+        with app.app_context():
+            return {"Authorization": f"Bearer {issue_tokens(user_id)['access_token']}"}
+    return headers
+
+
+@pytest.fixture
+def within_budget(app, client):
+    """Send a request and fail the test if its view goes over its @query_budget:
+    `within_budget("GET", "/planets")`. Streamed bodies are drained and counted too."""
+    from utils import check_query_budget
+
+    def request(method, url, **kwargs):
+        return check_query_budget(app, client, method, url, **kwargs)
+    return request
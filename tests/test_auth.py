@@ -0,0 +1,81 @@
+import pytest
+from conftest import PASSWORD
+
+
+def login(client, **body):
+    return client.post("/login", json=body)
+
+
+def test_login_issues_tokens_that_open_the_users_favorites(client):
+    response = login(client, username="user1", password=PASSWORD)
+    assert response.status_code == 200
+    access_token = response.get_json()["access_token"]
+    favorites = client.get("/users/favorites/1", headers={"Authorization": f"Bearer {access_token}"})
+    assert favorites.status_code == 200
+
+
+@pytest.mark.parametrize("body", [{"username": "user1", "password": 123}, {"username": ["user1"], "password": PASSWORD},
+                                  {"username": "user1"}, ["user1", PASSWORD], "user1"])
+def test_login_rejects_malformed_bodies(client, body):
+    assert client.post("/login", json=body).status_code == 400
+
+
+def test_login_with_a_wrong_password_fails(client):
+    assert login(client, username="user1", password="wrong").status_code == 400
+
+
+@pytest.mark.parametrize("body", [{"refresh_token": 5}, {"refresh_token": None}, {}, {"refresh_token": "garbage"}])
+def test_refresh_rejects_bad_tokens(client, body):
+    assert client.post("/token/refresh", json=body).status_code == 401
+
+
+def test_refresh_rejects_a_non_object_body(client):
+    assert client.post("/token/refresh", json=["token"]).status_code == 400
+
+
+def test_refresh_token_issues_new_tokens(client):
+    refresh_token = login(client, username="user1", password=PASSWORD).get_json()["refresh_token"]
+    response = client.post("/token/refresh", json={"refresh_token": refresh_token})
+    assert response.status_code == 200
+    assert response.get_json()["access_token"]
+
+
+def test_access_token_is_not_a_refresh_token(client, auth_headers):
+    access_token = auth_headers(1)["Authorization"].split()[1]
+    assert client.post("/token/refresh", json={"refresh_token": access_token}).status_code == 401
+
+
+def test_refresh_token_is_not_an_access_token(client):
+    refresh_token = login(client, username="user1", password=PASSWORD).get_json()["refresh_token"]
+    response = client.get("/users/favorites/1", headers={"Authorization": f"Bearer {refresh_token}"})
+    assert response.status_code == 401
+
+
+def test_missing_token_is_unauthorized(client):
+    assert client.get("/users/favorites/1").status_code == 401
+
+
+def test_another_users_token_is_forbidden(client, auth_headers):
+    assert client.get("/users/favorites/1", headers=auth_headers(2)).status_code == 403
+    assert client.delete("/users/favorites/1/planet/1", headers=auth_headers(2)).status_code == 403
+
+
+def test_expired_access_token_is_rejected(app, client, auth_headers, monkeypatch):
+    headers = auth_headers(1)
+    monkeypatch.setitem(app.config, "ACCESS_TOKEN_TTL", -1)
+    response = client.get("/users/favorites/1", headers=headers)
+    assert response.status_code == 401
+    assert response.get_json()["message"] == "Token has expired"
+
+
+@pytest.mark.parametrize("key", ["sample key", "any key works", None])
+def test_placeholder_signing_key_is_refused(app, client, auth_headers, monkeypatch, key):
+    from auth import signing_key_configured
+
+    headers = auth_headers(1)
+    monkeypatch.setattr(app, "secret_key", key)
+    assert not signing_key_configured(app)
+    response = login(client, username="user1", password=PASSWORD)
+    assert response.status_code == 500
+    assert "FLASK_APP_KEY" in response.get_json()["message"]
+    assert client.get("/users/favorites/1", headers=headers).status_code == 500
@@ -0,0 +1,32 @@
+import pytest
+from conftest import sync_replicas
+
+
+@pytest.mark.parametrize("item,error", [({"name": "x", "speed": "fast"}, "speed must be an integer"),
+                                        ({"name": "x", "speed": True}, "speed must be an integer"),
+                                        ({"name": "x", "faction": ["Empire"]}, "faction must be a string"),
+                                        ({"name": "x" * 101}, "name must be at most 100 characters"),
+                                        ({"speed": 1}, "with a name")])
+def test_invalid_items_are_rejected_with_their_index(client, item, error):
+    response = client.post("/starships", json=[{"name": "fine", "speed": 1}, item])
+    assert response.status_code == 400
+    assert error in response.get_json()["message"]
+    assert response.get_json()["index"] == 1
+    assert client.get("/starships?name=fine").get_json()["results"] == []
+
+
+def test_values_are_coerced_to_the_column_types(app, client):
+    response = client.post("/starships", json=[{"name": "coerced", "speed": "1200", "faction": 7}])
+    assert response.status_code == 200
+    sync_replicas(app)
+    starship = client.get(f"/starships/{response.get_json()['ids'][0]}").get_json()
+    assert starship["speed"] == 1200 and starship["faction"] == "7"
+
+
+def test_bulk_insert_invalidates_the_read_cache(app, client, monkeypatch):
+    from cache import read_cache
+
+    invalidated = []
+    monkeypatch.setattr(read_cache, "invalidate", lambda model_name, ids=None: invalidated.append((model_name, ids)))
+    assert client.post("/planets", json=[{"name": "Bulk", "mass": "1"}]).status_code == 200
+    assert invalidated == [("Planet", None)]
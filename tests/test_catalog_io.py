@@ -0,0 +1,86 @@
+import io
+import json
+import pytest
+from sqlalchemy import select
+
+DOCUMENT = """
+ [ {"id": 1, "name": "Tatooine, \\"twin suns\\"", "tags": ["desert", "]"]} ,
+   {"id": 2, "name": "Hoth\\u00e9", "nested": {"a": [1, 2.5, {"b": null}]}},12345,
+   -0.25e3 , true,false,null, "a string, with ] and [",
+   []] trailing text is never read
+"""
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 5, 7, 64, 1 << 16])
+def test_json_array_elements_split_across_reads(read_size):
+    from catalog_io import iter_json_array
+
+    expected = json.loads(DOCUMENT[:DOCUMENT.index("trailing")])
+    assert list(iter_json_array(io.StringIO(DOCUMENT), read_size=read_size)) == expected
+
+
+@pytest.mark.parametrize("document,error", [("", "unexpected end"), ("   ", "unexpected end"),
+                                            ("[", "unexpected end"), ('[{"name": "a"}', "unexpected end"),
+                                            ("[12", "unexpected end"), ('[{"name": "a"}, {"name": ', "Expecting"),
+                                            ('[{"name": "a', "Unterminated"), ('{"name": "a"}', "JSON array")])
+@pytest.mark.parametrize("read_size", [1, 4, 1 << 16])
+def test_truncated_or_invalid_json_is_an_error(document, error, read_size):
+    from catalog_io import iter_json_array
+
+    with pytest.raises(ValueError, match=error):
+        list(iter_json_array(io.StringIO(document), read_size=read_size))
+
+
+def import_records(app, catalog, records, **kwargs):
+    from catalog_io import import_catalog
+    from models import db
+
+    with app.app_context():
+        return import_catalog(db.session, catalog, records, **kwargs)
+
+
+def starships(app):
+    from models import db, Starship
+
+    with app.app_context():
+        return {row.id: row for row in db.session.execute(
+            select(Starship.id, Starship.name, Starship.speed, Starship.faction, Starship.status))}
+
+
+def test_csv_values_are_coerced_to_the_column_types(seeded):
+    from catalog_io import read_records
+
+    dump = "id,name,speed,faction,status\n,Imported,1200,,docked\n"
+    assert import_records(seeded, "starships", read_records(io.StringIO(dump), "csv")) == 1
+    imported = [row for row in starships(seeded).values() if row.name == "Imported"]
+    assert [(row.speed, row.faction, row.status) for row in imported] == [(1200, None, "docked")]
+
+
+@pytest.mark.parametrize("dump,error", [("id,name,speed\n,Fine,1\n,Slow,fast\n", "record 2: speed must be an integer"),
+                                        ("id,name,speed\nx,Bad id,1\n", "record 1: id must be an integer"),
+                                        ("id,name,speed\n7,,1\n", "record 1: every record must be an object")])
+def test_invalid_csv_records_name_their_number(seeded, dump, error):
+    from catalog_io import read_records
+
+    with pytest.raises(ValueError, match=error):
+        import_records(seeded, "starships", read_records(io.StringIO(dump), "csv"))
+
+
+def test_reimporting_existing_ids_updates_them(seeded):
+    before = starships(seeded)
+    records = [{"id": 1, "name": "Renamed", "speed": 1}, {"name": "Brand new", "speed": 2}]
+    assert import_records(seeded, "starships", records) == 2
+    after = starships(seeded)
+    assert len(after) == len(before) + 1
+    assert (after[1].name, after[1].speed) == ("Renamed", 1)
+    assert after[2] == before[2]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1000])
+def test_the_last_record_of_a_repeated_id_wins(seeded, chunk_size):
+    records = [{"id": 1, "name": "First", "speed": 1}, {"id": 1, "name": "Second", "speed": 2},
+               {"id": 2, "name": "Other", "speed": 3}, {"id": 1, "name": "Last", "speed": 4}]
+    assert import_records(seeded, "starships", records, chunk_size=chunk_size) == 4
+    after = starships(seeded)
+    assert (after[1].name, after[1].speed) == ("Last", 4)
+    assert after[2].name == "Other"
@@ -0,0 +1,59 @@
+import pytest
+from conftest import sync_replicas, CATALOG_SIZE
+
+NEW_PLANET = {"name": "New planet", "mass": "1", "description": "new"}
+
+
+def write(app, client, method, url, **kwargs):
+    response = client.open(url, method=method, **kwargs)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    sync_replicas(app)
+
+
+def test_unchanged_collection_is_not_modified(client):
+    first = client.get("/planets")
+    assert first.status_code == 200 and first.headers["ETag"]
+    assert "Accept" in first.headers["Vary"]
+    again = client.get("/planets", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == first.headers["ETag"]
+
+
+@pytest.mark.parametrize("method,url,kwargs", [("POST", "/planets", {"json": NEW_PLANET}),
+                                               ("DELETE", f"/planets/{CATALOG_SIZE}", {})])
+def test_if_none_match_sees_inserts_and_deletes(app, client, method, url, kwargs):
+    etag = client.get("/planets").headers["ETag"]
+    write(app, client, method, url, **kwargs)
+    response = client.get("/planets", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("method,url,kwargs", [("POST", "/planets", {"json": NEW_PLANET}),
+                                               ("DELETE", f"/planets/{CATALOG_SIZE}", {})])
+def test_collections_ignore_if_modified_since(app, client, method, url, kwargs):
+    first = client.get("/planets")
+    assert "Last-Modified" not in first.headers
+    write(app, client, method, url, **kwargs)
+    response = client.get("/planets", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert response.status_code == 200
+    assert len(response.get_json()["results"]) == CATALOG_SIZE + (1 if method == "POST" else -1)
+
+
+def test_stream_and_page_have_different_etags(client):
+    etag = client.get("/planets").headers["ETag"]
+    response = client.get("/planets", headers={"If-None-Match": etag, "Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert response.headers["ETag"] != etag
+    assert "Accept" in response.headers["Vary"]
+    again = client.get("/planets", headers={"If-None-Match": response.headers["ETag"],
+                                            "Accept": "application/x-ndjson"})
+    assert again.status_code == 304
+
+
+def test_single_item_if_modified_since(client):
+    first = client.get("/planets/1")
+    assert first.headers["Last-Modified"]
+    response = client.get("/planets/1", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert response.status_code == 304
@@ -0,0 +1,19 @@
+import gzip
+
+
+def test_favorites_export_is_not_served_over_http(client, auth_headers):
+    assert client.get("/export/favorites", headers=auth_headers(1)).status_code == 404
+
+
+def test_gzip_export_uses_content_encoding(client):
+    response = client.get("/export/planets?format=csv", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["Content-Disposition"].endswith("planets.csv")
+    assert gzip.decompress(response.get_data()).decode().startswith("id,name")
+
+
+def test_gzip_refused_with_q_zero_is_not_used(client):
+    response = client.get("/export/planets?format=csv", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data(as_text=True).startswith("id,name")
@@ -0,0 +1,31 @@
+import sys
+import pytest
+from sqlalchemy import false, insert
+
+
+def test_first_favorite_of_a_user_is_created_within_budget(within_budget, auth_headers):
+    response = within_budget("POST", "/users/favorites/2/planet/1", headers=auth_headers(2))
+    assert response.status_code == 200
+    assert [planet["id"] for planet in response.get_json()["planets"]] == [1]
+
+
+@pytest.mark.parametrize("method", ["POST", "DELETE"])
+def test_first_favorite_tolerates_a_concurrent_first_write(app, client, auth_headers, monkeypatch, method):
+    from models import db, Favorite
+    app_module = sys.modules["app"]
+    favorites_for_user = app_module.favorites_for_user
+    raced = []
+
+    def racing_favorites_for_user(user_id):
+        if raced:
+            return favorites_for_user(user_id)
+        # Another request creates the row after this one looked for it and found nothing
+        raced.append(user_id)
+        with db.engine.begin() as connection:
+            connection.execute(insert(Favorite.__table__), {"user_id": user_id})
+        return favorites_for_user(user_id).where(false())
+
+    monkeypatch.setattr(app_module, "favorites_for_user", racing_favorites_for_user)
+    response = client.open("/users/favorites/2/planet/1", method=method, headers=auth_headers(2))
+    assert raced == [2]
+    assert response.status_code == 200, response.get_data(as_text=True)
@@ -0,0 +1,14 @@
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+
+
+def test_autogenerate_leaves_the_search_index_alone(seeded):
+    from models import db
+    from search import include_object
+
+    with seeded.app_context(), db.engine.connect() as connection:
+        tables = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE name LIKE '%\\_fts%' ESCAPE '\\'")
+        assert len(tables.all()) > 3  # the FTS5 tables db.create_all() added outside the metadata
+        context = MigrationContext.configure(connection, opts={"include_object": include_object,
+                                                               "compare_type": True})
+        assert compare_metadata(context, db.metadata) == []
@@ -0,0 +1,58 @@
+import pytest
+from conftest import PASSWORD, CATALOG_SIZE
+
+SKIPPED_PREFIXES = ("/admin", "/static")
+
+# URL arguments: user 1 owns favorite planet/character/starship 1; the last row of each
+# catalog is never favorited, so deleting it touches no association rows
+URL_VALUES = {"user_id": 1, "planet_id": CATALOG_SIZE, "character_id": CATALOG_SIZE,
+              "starship_id": CATALOG_SIZE, "item_type": "planet", "item_id": 1, "source": "planets"}
+BODIES = {
+    "crear_usuario": {"username": "new", "email": "new@example.com", "password": PASSWORD},
+    "login": {"username": "user1", "password": PASSWORD},
+    "create_planet": {"name": "New planet", "mass": "1", "description": "new"},
+    "create_starship": {"name": "New starship", "speed": 1000, "faction": "Rebel"},
+    "create_character": {"name": "New character", "description": "new"},
+    "update_user_favorites": {"add": {"planet": [2, 3]}, "remove": {"character": [1]}},
+}
+QUERY_STRINGS = {"search_catalog": "?q=desert"}
+
+
+def routes():
+    from app import app
+    return [pytest.param(rule, method, id=f"{method} {rule.rule}")
+            for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule)
+            if not rule.rule.startswith(SKIPPED_PREFIXES)
+            for method in sorted(rule.methods - {"HEAD", "OPTIONS"})]
+
+
+@pytest.mark.parametrize("rule,method", routes())
+def test_route_stays_within_query_budget(app, rule, method, within_budget, auth_headers):
+    assert getattr(app.view_functions[rule.endpoint], "query_budget", None) is not None, \
+        f"{rule.endpoint} has no @query_budget"
+    url = rule.build(URL_VALUES, append_unknown=False)[1] + QUERY_STRINGS.get(rule.endpoint, "")
+    body = BODIES.get(rule.endpoint)
+    if rule.endpoint == "add_user_favorites":
+        url = url.replace("/planet/1", "/planet/2")
+    if rule.endpoint == "delete_single_user":
+        url = "/users/2"  # user 1 has favorites
+    if rule.endpoint == "refresh_token":
+        from auth import issue_tokens
+        with app.app_context():
+            body = {"refresh_token": issue_tokens(1)["refresh_token"]}
+    response = within_budget(method, url, json=body, headers=auth_headers(1))
+    assert response.status_code < 500, response.get_data(as_text=True)
+
+
+def test_bulk_create_is_one_statement(within_budget, auth_headers):
+    items = [{"name": f"Bulk {i}", "mass": "1", "description": "bulk"} for i in range(100)]
+    response = within_budget("POST", "/planets", json=items)
+    assert response.status_code == 200
+    assert len(response.get_json()["ids"]) == 100
+
+
+@pytest.mark.parametrize("url", ["/planets?stream=1", "/starships?format=ndjson", "/export/planets?format=csv"])
+def test_streamed_responses_count_queries_run_while_streaming(url, within_budget, auth_headers):
+    response = within_budget("GET", url, headers=auth_headers(1))
+    assert response.status_code == 200
+
@@ -0,0 +1,30 @@
+import sqlite3
+from conftest import sync_replicas, DATABASE_DIR
+
+REPLICA_FILE = f"{DATABASE_DIR}/replica.db"
+
+
+def rename_on_replica(planet_id, name):
+    with sqlite3.connect(REPLICA_FILE) as replica:
+        replica.execute("UPDATE planets SET name = ? WHERE id = ?", (name, planet_id))
+
+
+def test_reads_go_to_the_replica(client):
+    rename_on_replica(1, "Replica planet")
+    assert client.get("/planets/1").get_json()["name"] == "Replica planet"
+    assert client.get("/planets?ids=1").get_json()["results"][0]["name"] == "Replica planet"
+
+
+def test_writes_go_to_the_primary(client):
+    response = client.post("/planets", json={"name": "Written", "mass": "1", "description": "new"})
+    assert response.status_code == 200
+    with sqlite3.connect(REPLICA_FILE) as replica:
+        assert replica.execute("SELECT COUNT(*) FROM planets WHERE name = 'Written'").fetchone()[0] == 0
+
+
+def test_lagging_replica_reads_are_not_cached_after_a_local_write(app, client):
+    assert client.delete("/planets/5").status_code == 200
+    # The replica has not caught up: the read is stale, but must not be kept in the cache
+    assert client.get("/planets/5").status_code == 200
+    sync_replicas(app)
+    assert client.get("/planets/5").status_code == 404
@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import insert, text
+from conftest import sync_replicas, CATALOG_SIZE
+
+# speeds of the starships added on top of the seeded ones: ties and NULLs on both sides
+EXTRA_SPEEDS = [None, 300, None, 300, 700, None]
+
+
+@pytest.fixture
+def mixed_speeds(seeded):
+    from cache import read_cache
+    from models import db, Starship
+
+    with seeded.app_context():
+        db.session.execute(insert(Starship), [{"name": f"Extra {i}", "speed": speed}
+                                              for i, speed in enumerate(EXTRA_SPEEDS)])
+        db.session.commit()
+    sync_replicas(seeded)
+    read_cache.clear()
+    speeds = [i * 100 for i in range(1, CATALOG_SIZE + 1)] + EXTRA_SPEEDS
+    return {item_id: speed for item_id, speed in enumerate(speeds, start=1)}
+
+
+def walk(within_budget, url):
+    ids, cursor = [], None
+    while True:
+        page = within_budget("GET", url + (f"&after={cursor}" if cursor else "")).get_json()
+        ids += [item["id"] for item in page["results"]]
+        cursor = page["next"]
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 2, 3, 50])
+def test_sorted_pages_list_every_row_once_with_nulls_last(within_budget, mixed_speeds, descending, limit):
+    sort = "-speed" if descending else "speed"
+    present = sorted((item_id for item_id, speed in mixed_speeds.items() if speed is not None),
+                     key=lambda item_id: (mixed_speeds[item_id], item_id), reverse=descending)
+    missing = sorted((item_id for item_id, speed in mixed_speeds.items() if speed is None), reverse=descending)
+    assert walk(within_budget, f"/starships?sort={sort}&limit={limit}") == present + missing
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_streamed_sorted_listing_matches_the_pages(within_budget, mixed_speeds, descending):
+    sort = "-speed" if descending else "speed"
+    streamed = within_budget("GET", f"/starships?sort={sort}&stream=1").get_json()["results"]
+    assert [item["id"] for item in streamed] == walk(within_budget, f"/starships?sort={sort}&limit=2")
+
+
+@pytest.mark.parametrize("sort,after", [(("speed", False), None), (("speed", True), (300, 7)),
+                                        (("speed", False), (None, 6)), (("name", True), ("Starship 3", 3)),
+                                        (("id", True), (4, 4))])
+def test_sorted_selects_are_index_range_scans(seeded, sort, after):
+    from models import db, Starship
+    from utils import _list_selects
+
+    with seeded.app_context():
+        for stmt in _list_selects(Starship, None, (), sort, after):
+            sql = stmt.limit(10).compile(db.engine, compile_kwargs={"literal_binds": True})
+            plan = " ".join(row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+            assert "TEMP B-TREE" not in plan and "MULTI-INDEX OR" not in plan, plan
+            assert "INDEX" in plan or "PRIMARY KEY" in plan, plan
+
+
+def test_a_sort_needs_an_index_ending_in_id():
+    from models import Starship
+    from utils import unindexed_filters, metadata_indexes
+
+    assert unindexed_filters(Starship, metadata_indexes(Starship.__table__)) == []
+    single_column = [(("id",), True), (("name", "id"), False), (("speed",), False),
+                     (("faction",), False), (("status",), False)]
+    assert unindexed_filters(Starship, single_column) == ["speed"]